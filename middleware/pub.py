@@ -1,14 +1,47 @@
 #!/usr/bin/env python3
 
+import base64
+import contextlib
 import json
 import time
 import logging
+import logging.handlers
+import queue
 import signal
+import socket
 import sys
-from datetime import datetime
 from pathlib import Path
-import paho.mqtt.client as mqtt
-from thermal_utils import ThermalInterface
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, fall back to stdlib json
+    orjson = None
+
+
+# paho.mqtt.client.MQTT_ERR_SUCCESS; paho itself is imported lazily in _setup_mqtt
+MQTT_ERR_SUCCESS = 0
+
+# Sensor description shared by every frame, serialized once at import
+SENSOR_METADATA = {
+    "sensor_type": "waveshare_thermal_camera_hat",
+    "resolution": "80x62",
+    "units": "celsius"
+}
+
+def _json_default(obj):
+    """Serialize numpy arrays/scalars that the encoder can't handle natively"""
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _dumps(obj):
+    """Serialize payload to JSON bytes (numpy arrays are encoded directly)"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_json_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, default=_json_default).encode('utf-8')
+
+_METADATA_FRAG = b',"metadata":' + _dumps(SENSOR_METADATA)
 
 class ThermalMQTTPublisher:
     def __init__(self, config_path):
@@ -18,6 +51,7 @@ class ThermalMQTTPublisher:
         self.thermal = None
         self.mqtt_client = None
         self.mqtt_client_local = None # Client for localhost
+        self._log_listener = None
         
         # Frame counting with reset
         self.frame_count = 0          # Cycling counter (0-99)
@@ -25,6 +59,43 @@ class ThermalMQTTPublisher:
         self.cycle_count = 0          # How many cycles completed
         self.frame_reset_limit = 100  # Reset every 100 frames
         
+        # Static config values used on every publish, resolved once
+        self._device_id = self.config['device']['device_id']
+        self._topic_data = self.config['topic']
+        self._topic_status = f"{self._topic_data}/status"
+        self._topic_error = f"{self._topic_data}/error"
+        self._topic_batch = f"{self._topic_data}/batch"
+        self._topic_raw = f"{self._topic_data}/raw"
+        self._qos = int(self.config['mqtt']['qos'])
+        # Frames are lossy telemetry, default to QoS 0 (status/error keep mqtt.qos)
+        self._frame_qos = int(self.config['publishing'].get('qos', 0))
+        
+        # Pre-serialized static part of the thermal payload (built in start())
+        self._static_json_prefix = None
+        
+        # Cached second-resolution part of the ISO timestamp
+        self._ts_cache = (None, "")  # (epoch second, its ISO prefix), see _now_iso
+        
+        # Next reconnect attempt for the inline-serviced local client
+        self._local_reconnect_at = 0
+        
+        # Earliest capture attempt after an error (non-blocking backoff)
+        self._next_retry = 0
+        
+        # Optional batching of frames sent to the primary broker
+        self._batch = []
+        self._batch_size = self.config['publishing'].get('batch', 1)
+        
+        # Optional delta gating: skip frames that barely changed (disabled when 0)
+        self._delta_eps = self.config['publishing'].get('delta_eps', 0)
+        self._heartbeat = self.config['publishing'].get('heartbeat', 10)
+        self._last_frame = None
+        self._last_pub_ts = 0
+        
+        # Encoding of the raw frame: "float" (JSON array), "int16" (base64 counts)
+        # or "binary" (float32 blob on a separate /raw topic)
+        self._raw_encoding = self.config['publishing'].get('raw_encoding', 'float')
+        
         # Setup logging
         self._setup_logging()
         self.logger = logging.getLogger('thermal_mqtt_publisher')
@@ -51,19 +122,29 @@ class ThermalMQTTPublisher:
         log_dir.mkdir(exist_ok=True)
         log_file = log_dir / 'thermal_mqtt.log'
         
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(log_file),
-                logging.StreamHandler(sys.stdout)
-            ]
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        file_handler = logging.FileHandler(log_file)
+        file_handler.setFormatter(formatter)
+        stream_handler = logging.StreamHandler(sys.stdout)
+        stream_handler.setFormatter(formatter)
+        
+        # Records are only queued on the calling thread, formatting and
+        # file/stdout writes happen on the listener's background thread
+        log_queue = queue.Queue(-1)
+        root_logger = logging.getLogger()
+        root_logger.setLevel(logging.INFO)
+        root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        self._log_listener = logging.handlers.QueueListener(
+            log_queue, file_handler, stream_handler
         )
+        self._log_listener.start()
     
     def _signal_handler(self, signum, frame):
         """Handle shutdown signals"""
         self.logger.info(f"Received signal {signum}, shutting down gracefully...")
-        self.stop()
+        # Only end the capture loop; stop() runs from main() once it has exited, since
+        # the signal may arrive while the capture thread is inside the local client's loop()
+        self.running = False
     
     def _update_frame_counters(self):
         """Update frame counters with reset logic"""
@@ -79,9 +160,22 @@ class ThermalMQTTPublisher:
                 f"(Total frames: {self.total_frame_count})"
             )
     
+    def _now_iso(self):
+        """Current local time in ISO format, the date part is formatted once per second"""
+        now = time.time()
+        sec = int(now)
+        # One tuple, so the paho and capture threads never pair a second with another's prefix
+        cached_sec, prefix = self._ts_cache
+        if sec != cached_sec:
+            prefix = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(sec))
+            self._ts_cache = (sec, prefix)
+        return f"{prefix}.{int((now - sec) * 1e6):06d}"
+    
     def _setup_mqtt(self):
         """Setup MQTT clients for both primary and local brokers"""
         try:
+            import paho.mqtt.client as mqtt
+            
             # 1. --- Setup primary MQTT client (from config) ---
             self.mqtt_client = mqtt.Client()
             if self.config['mqtt'].get('username'):
@@ -91,6 +185,8 @@ class ThermalMQTTPublisher:
                 )
             self.mqtt_client.on_connect = self._on_mqtt_connect
             self.mqtt_client.on_disconnect = self._on_mqtt_disconnect
+            self.mqtt_client.on_socket_open = self._on_mqtt_socket_open
+            self._limit_queues(self.mqtt_client)
             self.mqtt_client.connect(
                 self.config['mqtt']['broker_host'],
                 self.config['mqtt']['broker_port'],
@@ -100,11 +196,23 @@ class ThermalMQTTPublisher:
             self.logger.info("Primary MQTT client setup completed")
 
             # 2. --- Setup secondary MQTT client (localhost) ---
+            # Reuse the primary connection if it already points to the local broker
+            if self._primary_is_local():
+                self.mqtt_client_local = self.mqtt_client
+                self.logger.info("Primary broker is local, sharing one MQTT client")
+                return True
+            
             self.mqtt_client_local = mqtt.Client()
             self.mqtt_client_local.on_connect = self._on_mqtt_local_connect
             self.mqtt_client_local.on_disconnect = self._on_mqtt_local_disconnect
+            self.mqtt_client_local.on_socket_open = self._on_mqtt_socket_open
+            # Queue publishes instead of writing each one immediately, so all
+            # packets of an iteration go out in one _service_local_client() flush
+            self.mqtt_client_local.on_socket_register_write = self._on_mqtt_local_write_pending
+            self._limit_queues(self.mqtt_client_local)
             self.mqtt_client_local.connect("localhost", 1883, 60)
-            self.mqtt_client_local.loop_start()
+            # No loop_start(): the local client is serviced from the capture
+            # loop (see _service_local_client) instead of its own network thread
             self.logger.info("Local MQTT client setup completed")
             
             return True
@@ -113,6 +221,53 @@ class ThermalMQTTPublisher:
             self.logger.error(f"MQTT setup failed: {e}")
             return False
 
+    def _limit_queues(self, client):
+        """Bound paho's in-flight and outgoing queues so a slow broker can't grow memory"""
+        client.max_inflight_messages_set(20)
+        client.max_queued_messages_set(100)
+
+    def _service_local_client(self, timeout=0.0):
+        """Run one network loop iteration of the local client in the capture thread"""
+        client = self.mqtt_client_local
+        if client is None or client is self.mqtt_client:
+            return False
+        
+        rc = client.loop(timeout=timeout)
+        if rc != MQTT_ERR_SUCCESS and time.monotonic() >= self._local_reconnect_at:
+            self._local_reconnect_at = time.monotonic() + 5
+            try:
+                client.reconnect()
+            except Exception as e:
+                self.logger.warning(f"Local MQTT reconnect failed: {e}")
+        return True
+
+    @contextlib.contextmanager
+    def _local_client_in_background(self):
+        """Let paho's network thread service the local client while the capture thread blocks"""
+        client = self.mqtt_client_local
+        if client is None or client is self.mqtt_client:
+            yield
+            return
+        client.loop_start()
+        try:
+            yield
+        finally:
+            client.loop_stop()
+
+    def _primary_is_local(self):
+        """Check whether the primary broker is the local broker"""
+        return (
+            self.config['mqtt']['broker_host'] in ('localhost', '127.0.0.1', '::1')
+            and int(self.config['mqtt']['broker_port']) == 1883
+        )
+
+    def _mirror_to_local(self, primary_topic, local_topic):
+        """Whether a message must be published again on the local broker"""
+        if self.mqtt_client_local is None:
+            return False
+        # With a shared client the same topic would otherwise be delivered twice
+        return not (self.mqtt_client_local is self.mqtt_client and primary_topic == local_topic)
+
     # --- Callbacks for Primary Client ---
     def _on_mqtt_connect(self, client, userdata, flags, rc):
         if rc == 0:
@@ -134,15 +289,26 @@ class ThermalMQTTPublisher:
     def _on_mqtt_local_disconnect(self, client, userdata, rc):
         self.logger.warning(f"Local MQTT disconnected with code {rc}")
 
+    def _on_mqtt_local_write_pending(self, client, userdata, sock):
+        """Pending local packets are written by _service_local_client()"""
+        pass
+    
+    def _on_mqtt_socket_open(self, client, userdata, sock):
+        """Disable Nagle so small MQTT packets are sent without delay"""
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except (OSError, AttributeError) as e:
+            self.logger.debug("Could not set TCP_NODELAY: %s", e)
+
     def _on_mqtt_publish(self, client, userdata, mid):
         pass
     
     def _publish_device_status(self, status):
         """Publish device online/offline status to both brokers"""
         status_payload = {
-            "device_id": self.config['device']['device_id'],
+            "device_id": self._device_id,
             "status": status,
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": self._now_iso(),
             "interface": self.thermal.interface if self.thermal else "unknown",
             "frame_info": {
                 "current_frame": self.frame_count,
@@ -150,23 +316,91 @@ class ThermalMQTTPublisher:
                 "cycle": self.cycle_count
             }
         }
-        payload_json = json.dumps(status_payload)
+        status_topic = self._topic_status
+        local_status_topic = "sensors/thermal_stream/status"
         
-        # Publish to primary broker
         try:
-            status_topic = f"{self.config['topic']}/status"
-            self.mqtt_client.publish(
-                status_topic, payload_json, qos=self.config['mqtt']['qos'], retain=True
-            )
+            payload_json = _dumps(status_payload)
+            
+            # Publish to primary broker
+            rc = self.mqtt_client.publish(
+                status_topic, payload_json, qos=self._qos, retain=True
+            ).rc
+            if rc != MQTT_ERR_SUCCESS:
+                self.logger.error("Failed to publish device status to primary broker: rc=%s", rc)
+            
+            # Publish to local broker
+            if self._mirror_to_local(status_topic, local_status_topic):
+                rc = self.mqtt_client_local.publish(
+                    local_status_topic, payload_json, qos=1, retain=True
+                ).rc
+                if rc != MQTT_ERR_SUCCESS:
+                    self.logger.error("Failed to publish device status to local broker: rc=%s", rc)
         except Exception as e:
-            self.logger.error(f"Failed to publish device status to primary broker: {e}")
+            self.logger.error("Failed to publish device status: %s", e)
 
-        # Publish to local broker
-        try:
-            local_status_topic = "sensors/thermal_stream/status"
-            self.mqtt_client_local.publish(local_status_topic, payload_json, qos=1, retain=True)
-        except Exception as e:
-            self.logger.error(f"Failed to publish device status to local broker: {e}")
+    def _build_payload_templates(self):
+        """Pre-serialize the static fields of the thermal payload"""
+        device = self.config['device']
+        static_fields = {
+            "device_id": device['device_id'],
+            "device_name": device['device_name'],
+            "location": device['location'],
+            "interface": self.thermal.interface
+        }
+        # Strip the closing brace so metadata and the dynamic fields can be appended
+        self._static_json_prefix = _dumps(static_fields)[:-1] + _METADATA_FRAG
+
+    def _frame_changed(self, frame_data):
+        """Check if a frame differs enough from the last published one"""
+        if self._delta_eps <= 0:
+            return True
+        
+        now = time.monotonic()
+        last = self._last_frame
+        if (last is not None
+                and last.shape == frame_data.shape
+                and now - self._last_pub_ts < self._heartbeat
+                and abs(frame_data - last).max() <= self._delta_eps):
+            return False
+        
+        self._last_frame = frame_data.copy()
+        self._last_pub_ts = now
+        return True
+
+    def _raw_fields(self, frame_data):
+        """Encode the raw frame according to publishing.raw_encoding"""
+        if self._raw_encoding == 'int16':
+            # 0.1 degC resolution: celsius = raw / scale + offset
+            scale, offset = 10, 0
+            counts = ((frame_data - offset) * scale).round().astype('<i2')
+            return {
+                "raw_bytes": base64.b64encode(counts.tobytes()).decode('ascii'),
+                "raw_dtype": "int16le",
+                "raw_shape": list(counts.shape),
+                "scale": scale,
+                "offset": offset
+            }
+        if self._raw_encoding == 'binary':
+            # Pixels are published separately by _publish_raw_frame()
+            return {
+                "raw_dtype": "float32le",
+                "raw_shape": list(frame_data.shape)
+            }
+        return {"raw_array": frame_data}
+
+    def _publish_raw_frame(self, frame_data):
+        """Publish the frame as a float32 little-endian blob on the raw topics"""
+        blob = frame_data.astype('<f4', copy=False).tobytes()
+        rc = self.mqtt_client.publish(self._topic_raw, blob, qos=self._frame_qos).rc
+        if rc != MQTT_ERR_SUCCESS:
+            self.logger.warning("Raw frame publish failed! Primary_rc: %s", rc)
+        
+        local_raw_topic = "sensors/thermal_stream/raw"
+        if self._mirror_to_local(self._topic_raw, local_raw_topic):
+            rc = self.mqtt_client_local.publish(local_raw_topic, blob, qos=self._frame_qos).rc
+            if rc != MQTT_ERR_SUCCESS:
+                self.logger.warning("Raw frame publish failed! Local_rc: %s", rc)
 
     def _publish_thermal_data(self, frame_data, stats):
         """Publish thermal data to both MQTT brokers with dynamic topic from config"""
@@ -174,69 +408,96 @@ class ThermalMQTTPublisher:
             # Update frame counters
             self._update_frame_counters()
             
+            timestamp = self._now_iso()
+            
             # === SAME PAYLOAD for BOTH BROKERS (raw data included) ===
-            payload = {
-                "timestamp": datetime.now().isoformat(),
-                "device_id": self.config['device']['device_id'],
-                "device_name": self.config['device']['device_name'],
-                "location": self.config['device']['location'],
-                "interface": self.thermal.interface,
-                "thermal_data": {
-                    "raw_array": frame_data.tolist() if hasattr(frame_data, 'tolist') else list(frame_data),
-                    "statistics": stats,
-                    "frame_count": self.frame_count,      # 0-99 cycling
-                    "cycle": self.cycle_count,            # How many resets
-                    "total_frames": self.total_frame_count # Total frames
-                },
-                "metadata": {
-                    "sensor_type": "waveshare_thermal_camera_hat",
-                    "resolution": "80x62",
-                    "units": "celsius"
-                }
-            }
+            # Static fields are cached in _static_json_prefix, only the
+            # dynamic fields are serialized per frame. join() assembles the
+            # document in one allocation instead of copying it per '+'
+            raw_fields = self._raw_fields(frame_data)
+            payload_json = b"".join((
+                self._static_json_prefix,
+                b',"timestamp":"', timestamp.encode(), b'"',
+                b',"thermal_data":{', _dumps(raw_fields)[1:-1],
+                b',"statistics":', _dumps(stats),
+                b',"frame_count":', str(self.frame_count).encode(),        # 0-99 cycling
+                b',"cycle":', str(self.cycle_count).encode(),              # How many resets
+                b',"total_frames":', str(self.total_frame_count).encode(),  # Total frames
+                b'}}'
+            ))
             
-            payload_json = json.dumps(payload)
+            if self._raw_encoding == 'binary':
+                self._publish_raw_frame(frame_data)
             
             # --- DYNAMIC TOPIC dari config (bukan hardcode) ---
-            primary_topic = self.config['topic']  # Dibaca dari mqtt_config.json
+            primary_topic = self._topic_data  # Dibaca dari mqtt_config.json
             
             # --- Publish to primary broker (menggunakan topic dari config) ---
-            result_primary = self.mqtt_client.publish(
-                primary_topic, payload_json, qos=self.config['mqtt']['qos']
-            )
+            if self._batch_size > 1:
+                # Collect frames and send them upstream as one message
+                primary_topic = self._topic_batch
+                # Serialized right away so the sensor buffer isn't kept referenced
+                self._batch.append(_dumps({
+                    "timestamp": timestamp,
+                    "frame_count": self.frame_count,
+                    "total_frames": self.total_frame_count,
+                    **raw_fields,
+                    "statistics": stats
+                }))
+                primary_rc = MQTT_ERR_SUCCESS
+                if len(self._batch) >= self._batch_size:
+                    primary_rc = self._publish_batch().rc
+            else:
+                primary_rc = self.mqtt_client.publish(
+                    primary_topic, payload_json, qos=self._frame_qos
+                ).rc
             
             # --- Publish to local broker (topic pattern dengan device_id) ---
             local_topic = f"sensors/thermal_stream"
-            result_local = self.mqtt_client_local.publish(
-                local_topic, payload_json, qos=1
-            )
+            if self._mirror_to_local(primary_topic, local_topic):
+                local_rc = self.mqtt_client_local.publish(
+                    local_topic, payload_json, qos=self._frame_qos
+                ).rc
+            else:
+                local_rc = primary_rc
             
-            if result_primary.rc == mqtt.MQTT_ERR_SUCCESS and result_local.rc == mqtt.MQTT_ERR_SUCCESS:
-                self.logger.debug(f"Frame {self.frame_count} published to: {primary_topic} & {local_topic}")
+            if primary_rc == MQTT_ERR_SUCCESS and local_rc == MQTT_ERR_SUCCESS:
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug("Frame %d published to: %s & %s",
+                                      self.frame_count, primary_topic, local_topic)
                 
                 # Log every 60 frames with topic info
                 if self.total_frame_count % 60 == 0:
-                    payload_size = len(payload_json)
                     self.logger.info(
-                        f"Frame {self.frame_count} (Cycle {self.cycle_count}, Total: {self.total_frame_count}): "
-                        f"Temp range: {stats['min_temp']:.1f}°C - {stats['max_temp']:.1f}°C, "
-                        f"Avg: {stats['avg_temp']:.1f}°C, "
-                        f"Primary Topic: {primary_topic}, "
-                        f"Local Topic: {local_topic}, "
-                        f"Interface: {self.thermal.interface}, "
-                        f"Payload size: {payload_size}B"
+                        "Frame %d (Cycle %d, Total: %d): "
+                        "Temp range: %.1f°C - %.1f°C, Avg: %.1f°C, "
+                        "Primary Topic: %s, Local Topic: %s, "
+                        "Interface: %s, Payload size: %dB",
+                        self.frame_count, self.cycle_count, self.total_frame_count,
+                        stats['min_temp'], stats['max_temp'], stats['avg_temp'],
+                        primary_topic, local_topic,
+                        self.thermal.interface, len(payload_json)
                     )
             else:
-                self.logger.warning(f"MQTT publish failed! Primary_rc: {result_primary.rc}, Local_rc: {result_local.rc}")
+                self.logger.warning("MQTT publish failed! Primary_rc: %s, Local_rc: %s",
+                                    primary_rc, local_rc)
                 
         except Exception as e:
             self.logger.error(f"Failed to publish thermal data: {e}")
     
+    def _publish_batch(self):
+        """Publish the collected frames as one message to the primary broker"""
+        payload_json = b"".join((
+            self._static_json_prefix, b',"frames":[', b','.join(self._batch), b']}'
+        ))
+        self._batch = []
+        return self.mqtt_client.publish(self._topic_batch, payload_json, qos=self._frame_qos)
+
     def _publish_error(self, error_msg):
         """Publish error message to both brokers"""
         error_payload = {
-            "device_id": self.config['device']['device_id'],
-            "timestamp": datetime.now().isoformat(),
+            "device_id": self._device_id,
+            "timestamp": self._now_iso(),
             "error": error_msg,
             "interface": self.thermal.interface if self.thermal else "unknown",
             "frame_info": {
@@ -245,21 +506,24 @@ class ThermalMQTTPublisher:
                 "cycle": self.cycle_count
             }
         }
-        payload_json = json.dumps(error_payload)
-
-        # Publish to primary broker
+        error_topic = self._topic_error
+        local_error_topic = "sensors/thermal_stream/error"
+        
         try:
-            error_topic = f"{self.config['topic']}/error"
-            self.mqtt_client.publish(error_topic, payload_json, qos=self.config['mqtt']['qos'])
-        except Exception as e:
-            self.logger.error(f"Failed to publish error to primary broker: {e}")
+            payload_json = _dumps(error_payload)
             
-        # Publish to local broker
-        try:
-            local_error_topic = "sensors/thermal_stream/error"
-            self.mqtt_client_local.publish(local_error_topic, payload_json, qos=1)
+            # Publish to primary broker
+            rc = self.mqtt_client.publish(error_topic, payload_json, qos=self._qos).rc
+            if rc != MQTT_ERR_SUCCESS:
+                self.logger.error("Failed to publish error to primary broker: rc=%s", rc)
+            
+            # Publish to local broker
+            if self._mirror_to_local(error_topic, local_error_topic):
+                rc = self.mqtt_client_local.publish(local_error_topic, payload_json, qos=1).rc
+                if rc != MQTT_ERR_SUCCESS:
+                    self.logger.error("Failed to publish error to local broker: rc=%s", rc)
         except Exception as e:
-            self.logger.error(f"Failed to publish error to local broker: {e}")
+            self.logger.error("Failed to publish error: %s", e)
 
     def get_frame_stats(self):
         """Get current frame statistics"""
@@ -278,28 +542,45 @@ class ThermalMQTTPublisher:
             self.logger.error("Failed to setup MQTT, exiting")
             return False
         
-        time.sleep(2)
-        
-        self.thermal = ThermalInterface(self.config)
-        if not self.thermal.initialize():
+        # CONNACK and pings of the local client still need handling during sensor setup
+        with self._local_client_in_background():
+            time.sleep(2)
+            
+            from thermal_utils import ThermalInterface
+            self.thermal = ThermalInterface(self.config)
+            initialized = self.thermal.initialize()
+        if not initialized:
             self.logger.error("Failed to initialize thermal sensor, exiting")
             return False
         
         self.logger.info(f"Thermal sensor initialized with {self.thermal.interface} interface")
+        self._build_payload_templates()
         self.logger.info(f"Frame counter will reset every {self.frame_reset_limit} frames")
         
         self.running = True
         error_count = 0
         max_errors = 10
         
+        # Fixed-rate schedule on the monotonic clock, so capture/publish time
+        # doesn't add drift to the publishing interval
+        interval = self.config['publishing']['interval']
+        next_deadline = time.monotonic() + interval
+        
         try:
             while self.running:
+                if time.monotonic() < self._next_retry:
+                    # Backing off after capture errors, keep the network loop ticking
+                    if not self._service_local_client(timeout=0.05):
+                        time.sleep(0.05)
+                    continue
+                
                 try:
                     frame_data = self.thermal.capture_frame()
                     if frame_data is not None:
                         stats = self.thermal.get_thermal_stats(frame_data)
                         if stats:
-                            self._publish_thermal_data(frame_data, stats)
+                            if self._frame_changed(frame_data):
+                                self._publish_thermal_data(frame_data, stats)
                             error_count = 0
                         else:
                             raise Exception("Failed to calculate thermal statistics")
@@ -314,17 +595,30 @@ class ThermalMQTTPublisher:
                     
                     if error_count >= max_errors:
                         self.logger.warning(f"Too many errors ({error_count}), restarting sensor...")
-                        if self.thermal.restart_sensor():
+                        with self._local_client_in_background():
+                            restarted = self.thermal.restart_sensor()
+                        if restarted:
                             self.logger.info("Sensor restarted successfully")
+                            # Interface may change after re-detection
+                            self._build_payload_templates()
                             error_count = 0
                         else:
                             self.logger.error("Sensor restart failed, continuing with errors...")
                             error_count = max_errors // 2
                     
-                    time.sleep(min(error_count * 2, 10))
+                    self._next_retry = time.monotonic() + min(error_count * 2, 10)
+                
+                # Process acks/pings and flush pending writes of the local client
+                self._service_local_client()
                 
                 if self.running:
-                    time.sleep(self.config['publishing']['interval'])
+                    sleep_for = next_deadline - time.monotonic()
+                    if sleep_for > 0:
+                        time.sleep(sleep_for)
+                        next_deadline += interval
+                    else:
+                        # Fell behind (slow capture or error backoff), don't burst to catch up
+                        next_deadline = time.monotonic() + interval
         
         except KeyboardInterrupt:
             self.logger.info("Keyboard interrupt received")
@@ -343,6 +637,8 @@ class ThermalMQTTPublisher:
         self.logger.info(f"Final frame statistics: {final_stats}")
         
         if self.mqtt_client and self.mqtt_client.is_connected():
+            if self._batch:
+                self._publish_batch()
             self._publish_device_status("offline")
             time.sleep(1)
         
@@ -353,11 +649,31 @@ class ThermalMQTTPublisher:
             self.mqtt_client.loop_stop()
             self.mqtt_client.disconnect()
         
-        if self.mqtt_client_local:
-            self.mqtt_client_local.loop_stop()
-            self.mqtt_client_local.disconnect()
+        if self.mqtt_client_local and self.mqtt_client_local is not self.mqtt_client:
+            self._flush_local_client()
         
         self.logger.info("Thermal MQTT Publisher stopped")
+    
+    def _flush_local_client(self, timeout=1.0):
+        """Write the queued offline status and DISCONNECT packet of the local client"""
+        client = self.mqtt_client_local
+        client.disconnect()
+        deadline = time.monotonic() + timeout
+        rc = MQTT_ERR_SUCCESS
+        # The socket is non-blocking, a full send buffer leaves packets queued
+        while client.want_write() and time.monotonic() < deadline:
+            rc = client.loop_write()
+            if rc != MQTT_ERR_SUCCESS:
+                break
+            time.sleep(0.01)
+        if rc != MQTT_ERR_SUCCESS or client.want_write():
+            self.logger.warning(f"Local MQTT offline status may not have been delivered (rc={rc})")
+    
+    def _stop_logging(self):
+        """Flush queued log records and stop the listener thread"""
+        if self._log_listener:
+            self._log_listener.stop()
+            self._log_listener = None
 
 def main():
     import argparse
@@ -388,7 +704,13 @@ def main():
         publisher.frame_reset_limit = args.reset_limit
         print(f"Frame counter reset limit set to: {args.reset_limit}")
     
-    publisher.start()
+    try:
+        publisher.start()
+    finally:
+        # Signals only end the capture loop, the shutdown itself happens here
+        publisher.stop()
+        # Only now nothing logs anymore, stopping the listener earlier would drop records
+        publisher._stop_logging()
 
 if __name__ == "__main__":
     main()
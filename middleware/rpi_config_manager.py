@@ -1,23 +1,153 @@
 #!/usr/bin/env python3
 
+import csv
+import filecmp
+import functools
 import json
 import time
 import logging
 import signal
 import sys
 import os
-import subprocess
+import re
 import shutil
+import types
+import socket
+import struct
+import subprocess
+import threading
+import queue
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from operator import itemgetter
 from pathlib import Path
-import paho.mqtt.client as mqtt
 
-# Import library gpiozero
-from gpiozero import Button
-from signal import pause
+try:
+    import orjson
+except ImportError:  # orjson is optional, fall back to stdlib json
+    orjson = None
+
+try:
+    import gi
+    gi.require_version('NM', '1.0')
+    from gi.repository import NM
+except (ImportError, ValueError):  # libnm (python3-gi) is optional, nmcli is used otherwise
+    NM = None
+
+# One escaped character in terse nmcli output (\: or \\), undone in a single pass
+NMCLI_ESCAPE_RE = re.compile(rb'\\(.)', re.DOTALL)
+
+# libnm device state nick -> state text as printed by nmcli
+NM_DEVICE_STATES = {
+    'activated': 'connected',
+    'prepare': 'connecting (prepare)',
+    'config': 'connecting (configuring)',
+    'need-auth': 'connecting (need authentication)',
+    'ip-config': 'connecting (getting IP configuration)',
+    'ip-check': 'connecting (checking IP connectivity)',
+    'secondaries': 'connecting (starting secondary connections)',
+    'failed': 'connection failed'
+}
+
+def _nm_value(raw):
+    """Decode one field of terse (-t) nmcli output, undoing its backslash escapes"""
+    return NMCLI_ESCAPE_RE.sub(rb'\1', raw).decode('utf-8', 'replace')
+
+def _nmcli_rows(output):
+    """Split terse (-t) nmcli text output into rows of fields, undoing its backslash escapes"""
+    return csv.reader(output.splitlines(), delimiter=':', escapechar='\\', quoting=csv.QUOTE_NONE)
+
+def _loads(data):
+    """Parse a JSON request payload or config file (str or bytes)"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def _dumps(obj):
+    """Serialize a response payload to JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+# MQTT topics (shared, read-only); values are interned since they are
+# compared against every incoming message topic
+TOPICS = types.MappingProxyType({k: sys.intern(v) for k, v in {
+    "get": "rpi/config/get",
+    "set": "rpi/config/set",
+    "response": "rpi/config/response",
+    "status": "rpi/config/status",  # Retained "online"/"offline", offline is the LWT
+    # Network IP Configuration Topics
+    "network_get": "rpi/network/get",
+    "network_set": "rpi/network/set",
+    "network_response": "rpi/network/response",
+    # WiFi Management Topics
+    "wifi_scan": "rpi/wifi/scan",
+    "wifi_scan_response": "rpi/wifi/scan_response",
+    "wifi_connect": "rpi/wifi/connect",
+    "wifi_connect_response": "rpi/wifi/connect_response",
+    "wifi_disconnect": "rpi/wifi/disconnect",
+    "wifi_disconnect_response": "rpi/wifi/disconnect_response",
+    "wifi_delete": "rpi/wifi/delete",
+    "wifi_delete_response": "rpi/wifi/delete_response",
+    "wifi_status": "rpi/wifi/status",
+    "wifi_status_get": "rpi/wifi/status/get",
+    "wifi_status_response": "rpi/wifi/status/response",
+    # Topik baru untuk Reboot dan Factory Reset
+    "reboot_request": "rpi/system/reboot",
+    "factory_reset_request": "rpi/system/factory_reset"
+}.items()})
+
+# One line of /etc/network/interfaces: "auto <iface>", "iface <iface> <family> <method>"
+# or one of the address options we care about
+INTERFACES_LINE_RE = re.compile(
+    r'^[ \t]*(?:'
+    r'auto[ \t]+(\S+)[^\n]*'
+    r'|iface[ \t]+(\S+)[ \t]+\S+[ \t]+(\S+)[^\n]*'
+    r'|(address|netmask|gateway|dns-nameservers)[ \t]+([^\n]*?)[ \t]*'
+    r')$',
+    re.MULTILINE
+)
+
+# First IPv4 address in "nmcli device show" output
+IPV4_ADDRESS_RE = re.compile(r"IP4\.ADDRESS\[1\]:\s*(\d{1,3}(?:\.\d{1,3}){3})/\d+")
+
+# Options rewritten inside the target iface stanza and keywords that start a new stanza
+INTERFACES_DROP_PREFIXES = (
+    "address ", "netmask ", "gateway ", "dns-nameservers ", "pre-up ", "post-down "
+)
+INTERFACES_STANZA_PREFIXES = ("iface ", "auto ", "allow-", "mapping ", "source")
+
+# Responses go to the broker on localhost, no PUBACK round trip needed
+RESPONSE_QOS = 0
+
+# Seconds a WiFi status result is reused by get_wifi_status
+WIFI_STATUS_TTL = 2.0
+
+# Requests waiting for or in the handler worker before new ones are refused
+MAX_PENDING_REQUESTS = 16
+
+# Fields _publish puts in front of every response
+ENVELOPE_KEYS = frozenset(("status", "timestamp", "device_id"))
+
+# WiFi responses larger than this are zlib-compressed to <topic>/z when
+# "config_manager": {"compress_wifi": true} is set in the config
+WIFI_COMPRESS_THRESHOLD = 512
+
+# Request topics the manager subscribes to
+REQUEST_TOPIC_KEYS = (
+    "get", "set", "network_get", "network_set",
+    "wifi_scan", "wifi_connect", "wifi_disconnect", "wifi_delete",
+    "wifi_status_get",
+    "reboot_request",   # Topik baru
+    "factory_reset_request"  # Topik baru
+)
 
 class ButtonHandler:
     def __init__(self, manager, gpio_pin=26):
+        # Import library gpiozero (lazily, only needed once the handler is created)
+        from gpiozero import Button
+        
         self.manager = manager
         # Inisialisasi tombol dengan pull-up internal
         self.reset_button = Button(gpio_pin, pull_up=True, bounce_time=0.1)
@@ -57,61 +187,93 @@ class RPiConfigManager:
         self.config_path = config_path
         self.config = {}
         self.running = False
+        self._stop_event = threading.Event()
         self.mqtt_client = None
         
+        # Handlers run on one worker thread, so paho's network loop never waits for
+        # nmcli/systemctl and requests are still handled in arrival order
+        self._handler_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cfg-handler")
+        self._pending_requests = threading.BoundedSemaphore(MAX_PENDING_REQUESTS)
+        
+        # Responses are serialized by the handlers and published by one writer thread
+        self._publish_queue = queue.Queue()
+        self._publisher_thread = None
+        self._iso_cache = (0, "")  # (epoch second, its ISO timestamp), see _now_iso
+        self._envelope_cache = ("", {})  # (timestamp, {status: serialized envelope head}), see _publish
+        
+        # Debounced config writes (see save_config)
+        self._save_lock = threading.Lock()
+        self._save_timer = None
+        self._config_dirty = False
+        self._restart_after_save = False
+        self._config_stamp = None  # (inode, mtime, size) of the last loaded config file
+        
+        # Coalesced networking restarts (see restart_networking_service)
+        self._network_restart_lock = threading.Lock()
+        self._network_restart_timer = None
+        
         # MQTT Settings untuk config manager (localhost)
         self.broker_host = "localhost"
         self.broker_port = 1883
         self.device_id = "rpi_config_manager"
         
         # Topics
-        self.topics = {
-            "get": "rpi/config/get",
-            "set": "rpi/config/set", 
-            "response": "rpi/config/response",
-            # Network IP Configuration Topics
-            "network_get": "rpi/network/get",
-            "network_set": "rpi/network/set",
-            "network_response": "rpi/network/response",
-            # WiFi Management Topics
-            "wifi_scan": "rpi/wifi/scan",
-            "wifi_scan_response": "rpi/wifi/scan_response",
-            "wifi_connect": "rpi/wifi/connect",
-            "wifi_connect_response": "rpi/wifi/connect_response",
-            "wifi_disconnect": "rpi/wifi/disconnect",
-            "wifi_disconnect_response": "rpi/wifi/disconnect_response",
-            "wifi_delete": "rpi/wifi/delete",
-            "wifi_delete_response": "rpi/wifi/delete_response",
-            "wifi_status": "rpi/wifi/status",
-            "wifi_status_get": "rpi/wifi/status/get",
-            "wifi_status_response": "rpi/wifi/status/response",
-            # Topik baru untuk Reboot dan Factory Reset
-            "reboot_request": "rpi/system/reboot",
-            "factory_reset_request": "rpi/system/factory_reset"
+        self.topics = TOPICS
+        
+        # Request topic -> handler, every handler takes the raw payload bytes
+        self._message_handlers = {
+            TOPICS["get"]: self._handle_get_config,
+            TOPICS["set"]: self._handle_set_config,
+            TOPICS["network_get"]: self._handle_get_network_config,
+            TOPICS["network_set"]: self._handle_set_network_config,
+            TOPICS["wifi_scan"]: self._handle_wifi_scan,
+            TOPICS["wifi_connect"]: self._handle_wifi_connect,
+            TOPICS["wifi_disconnect"]: self._handle_wifi_disconnect,
+            TOPICS["wifi_delete"]: self._handle_wifi_delete,
+            TOPICS["wifi_status_get"]: self._handle_wifi_status_get,
+            TOPICS["reboot_request"]: self._handle_reboot_request,
+            TOPICS["factory_reset_request"]: self._handle_factory_reset_request
         }
         
+        # Setup logging (before network detection, which may log errors)
+        self._setup_logging()
+        self.logger = logging.getLogger('rpi_config_manager')
+        
         # Network configuration - detect which system to use
         self.network_method = self._detect_network_method()
         
         # Set paths based on detected method
+        self._nm = None
+        self._eth_name_cache = {}  # interface -> (monotonic time, connection name)
+        self._wifi_status_cache = (0.0, None)  # (monotonic time, status dict)
+        self._wifi_status_lock = threading.Lock()  # one nmcli status query at a time
+        self._saved_wifi_cache = (0.0, None)  # (monotonic time, saved WiFi connection names)
         if self.network_method == 'networkmanager':
             self.nm_connections_dir = "/etc/NetworkManager/system-connections"
+            self._nm = self._create_nm_client()
         elif self.network_method == 'dhcpcd':
             self.dhcpcd_file = "/etc/dhcpcd.conf"
         elif self.network_method == 'interfaces':
             self.interfaces_file = "/etc/network/interfaces"
         
-        # Setup logging
-        self._setup_logging()
-        self.logger = logging.getLogger('rpi_config_manager')
+        # Resolve the per-method read/static/DHCP implementations once
+        dispatch = {
+            'networkmanager': (self._read_networkmanager_config, self._set_networkmanager_static, self._set_networkmanager_dhcp),
+            'dhcpcd': (self._read_dhcpcd_config, self._set_dhcpcd_static, self._set_dhcpcd_dhcp),
+            'interfaces': (self._read_interfaces_config, self._set_interfaces_static, self._set_interfaces_dhcp)
+        }
+        self._read_fn, self._set_static_fn, self._set_dhcp_fn = dispatch.get(
+            self.network_method, (None, None, None)
+        )
         
         # Load current config
         self.load_config()
         
         self.logger.info(f"RPi Config Manager initialized (network method: {self.network_method})")
         
-        # Inisialisasi ButtonHandler
-        self.button_handler = ButtonHandler(self)
+        # ButtonHandler (and gpiozero) is only created in start(), so the parsers
+        # can be used without claiming the GPIO pin
+        self.button_handler = None
     
     def _setup_logging(self):
         """Setup logging"""
@@ -129,103 +291,299 @@ class RPiConfigManager:
         )
     
     def load_config(self):
-        """Load mqtt_config.json"""
+        """Load mqtt_config.json, skipped while the file is unchanged since the last load"""
         try:
-            if os.path.exists(self.config_path):
-                with open(self.config_path, 'r') as f:
-                    self.config = json.load(f)
-                self.logger.info("Config loaded successfully")
-            else:
-                self.logger.warning(f"Config file not found: {self.config_path}")
-                self.config = {}
+            st = os.stat(self.config_path)
+        except FileNotFoundError:
+            self.logger.warning(f"Config file not found: {self.config_path}")
+            self.config = {}
+            self._config_stamp = None
+            return
         except Exception as e:
             self.logger.error(f"Error loading config: {e}")
             self.config = {}
+            self._config_stamp = None
+            return
+        
+        # os.replace() gives the file a new inode, so this also catches our own saves
+        stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if stamp == self._config_stamp:
+            return
+        
+        try:
+            with open(self.config_path, 'rb') as f:
+                data = f.read()
+            self.config = _loads(data)
+            self._config_stamp = stamp
+            self.logger.info("Config loaded successfully")
+        except Exception as e:
+            self.logger.error(f"Error loading config: {e}")
+            self.config = {}
+            self._config_stamp = None
     
     def save_config(self):
+        """Schedule a save of mqtt_config.json, a burst of changes is written once"""
+        with self._save_lock:
+            self._config_dirty = True
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+            # Non-daemon, so a pending write still completes on interpreter exit
+            self._save_timer = threading.Timer(0.25, self.flush_config)
+            self._save_timer.start()
+        return True
+    
+    def flush_config(self):
+        """Write pending config changes now, returns False if the write failed"""
+        with self._save_lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            if not self._config_dirty:
+                return True
+            self._config_dirty = False
+            restart = self._restart_after_save
+            self._restart_after_save = False
+            
+            success = self._write_config()
+        
+        if not success:
+            self._publish("response", {"action": "set_config", "error": "Failed to save config"}, status="error")
+        elif restart:
+            # The thermal service reads the file at startup, restart once it's on disk
+            self._restart_thermal_service()
+        return success
+    
+    def _write_config(self):
         """Save mqtt_config.json"""
         try:
-            # Backup dulu
-            if os.path.exists(self.config_path):
-                backup_path = f"{self.config_path}.backup.{int(time.time())}"
-                shutil.copy2(self.config_path, backup_path)
-                self.logger.info(f"Config backed up to: {backup_path}")
-            
-            # Save new config
-            with open(self.config_path, 'w') as f:
-                json.dump(self.config, f, indent=2)
+            if orjson is not None:
+                data = orjson.dumps(self.config, option=orjson.OPT_INDENT_2)
+            else:
+                data = json.dumps(self.config, indent=2).encode('utf-8')
             
-            self.logger.info("Config saved successfully")
+            # Backup dulu (ring of 3), skipped when nothing changed
+            if self._write_file_atomic(self.config_path, data, backups=3):
+                self.logger.info("Config saved successfully")
+            else:
+                self.logger.info("Config unchanged, skipping write")
             return True
         except Exception as e:
             self.logger.error(f"Error saving config: {e}")
             return False
     
+    def _write_file_atomic(self, path, data, backups=0):
+        """Atomically replace a file with bytes, str or an iterable of lines, returns False if unchanged"""
+        streaming = not isinstance(data, (str, bytes))
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        
+        if streaming:
+            exists = os.path.exists(path)
+        else:
+            try:
+                with open(path, 'rb') as f:
+                    if f.read() == data:
+                        return False
+                exists = True
+            except FileNotFoundError:
+                exists = False
+        
+        tmp_path = f"{path}.tmp.{os.getpid()}"
+        try:
+            with open(tmp_path, 'w' if streaming else 'wb') as f:
+                if streaming:
+                    f.writelines(data)
+                else:
+                    f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            
+            # Streamed content can only be compared once it is written out
+            if streaming and exists:
+                if filecmp.cmp(tmp_path, path, shallow=False):
+                    os.unlink(tmp_path)
+                    return False
+            
+            if exists and backups:
+                self._rotate_backups(path, backups)
+            
+            # Keep permissions and owner of the file being replaced
+            if exists:
+                st = os.stat(path)
+                os.chmod(tmp_path, st.st_mode & 0o7777)
+                try:
+                    os.chown(tmp_path, st.st_uid, st.st_gid)
+                except PermissionError:
+                    pass
+            
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        
+        # Persist the rename itself
+        dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+        return True
+    
+    def _rotate_backups(self, path, keep):
+        """Keep the last `keep` versions of a file as path.backup.0 (newest) .. path.backup.N"""
+        for i in range(keep - 1, 0, -1):
+            older = f"{path}.backup.{i - 1}"
+            if os.path.exists(older):
+                os.replace(older, f"{path}.backup.{i}")
+        
+        backup_path = f"{path}.backup.0"
+        shutil.copy2(path, backup_path)
+        self.logger.info(f"Backed up {path} to: {backup_path}")
+    
     # --- Network System Detection ---
     
     def _detect_network_method(self):
-        """Detect which network configuration method is used"""
+        """Detect which network configuration method is used (cached per boot)"""
+        cache_file = Path.home() / '.cache' / 'rpi_config' / 'network_method.json'
         try:
-            # Priority 1: Check NetworkManager (default on RPi5 Bookworm)
-            result = subprocess.run(['systemctl', 'is-active', 'NetworkManager'], 
-                                   capture_output=True, text=True)
-            if result.returncode == 0 and result.stdout.strip() == 'active':
-                return 'networkmanager'
-            
-            # Priority 2: Check dhcpcd (older RPi OS)
-            if os.path.exists('/etc/dhcpcd.conf'):
-                result = subprocess.run(['systemctl', 'is-active', 'dhcpcd'], 
-                                       capture_output=True, text=True)
-                if result.returncode == 0 and result.stdout.strip() == 'active':
-                    return 'dhcpcd'
-            
-            # Priority 3: Check systemd-networkd
-            result = subprocess.run(['systemctl', 'is-active', 'systemd-networkd'], 
-                                   capture_output=True, text=True)
-            if result.returncode == 0 and result.stdout.strip() == 'active':
-                return 'systemd-networkd'
-            
-            # Priority 4: Check interfaces file (legacy)
-            if os.path.exists('/etc/network/interfaces'):
-                with open('/etc/network/interfaces', 'r') as f:
-                    content = f.read().strip()
-                    if content and not all(line.startswith('#') for line in content.splitlines() if line.strip()):
-                        return 'interfaces'
-            
-            # Default fallback
-            return 'networkmanager'
-            
+            with open('/proc/sys/kernel/random/boot_id', 'r') as f:
+                boot_id = f.read().strip()
+        except OSError:
+            boot_id = None
+        
+        # The active network stack doesn't change without a reboot
+        if boot_id:
+            try:
+                with open(cache_file, 'r') as f:
+                    cached = json.load(f)
+                if cached.get('boot_id') == boot_id and cached.get('method'):
+                    return cached['method']
+            except (OSError, ValueError, AttributeError):
+                pass
+        
+        try:
+            method, service_active = self._probe_network_method()
         except Exception as e:
             self.logger.error(f"Error detecting network method: {e}")
             return 'networkmanager'
+        
+        # A fallback may only mean the network service hasn't started yet, probe again next time
+        if boot_id and service_active:
+            try:
+                cache_file.parent.mkdir(parents=True, exist_ok=True)
+                with open(cache_file, 'w') as f:
+                    json.dump({'boot_id': boot_id, 'method': method}, f)
+            except OSError as e:
+                self.logger.warning(f"Could not cache network method: {e}")
+        
+        return method
+    
+    def _probe_network_method(self):
+        """Check which network service is running, returns (method, found a running service)"""
+        active = self._active_services(['NetworkManager', 'dhcpcd', 'systemd-networkd'])
+        
+        # Priority 1: Check NetworkManager (default on RPi5 Bookworm)
+        if active['NetworkManager']:
+            return 'networkmanager', True
+        
+        # Priority 2: Check dhcpcd (older RPi OS)
+        if active['dhcpcd'] and os.path.exists('/etc/dhcpcd.conf'):
+            return 'dhcpcd', True
+        
+        # Priority 3: Check systemd-networkd
+        if active['systemd-networkd']:
+            return 'systemd-networkd', True
+        
+        # Priority 4: Check interfaces file (legacy)
+        if os.path.exists('/etc/network/interfaces'):
+            with open('/etc/network/interfaces', 'r') as f:
+                content = f.read().strip()
+                if content and not all(line.startswith('#') for line in content.splitlines() if line.strip()):
+                    return 'interfaces', False
+        
+        # Default fallback
+        return 'networkmanager', False
+    
+    def _active_services(self, services):
+        """Map service name -> running, without spawning processes where possible"""
+        # With the unified cgroup hierarchy every running service has its own
+        # cgroup directory, which is a plain stat instead of a systemctl call
+        slice_dir = '/sys/fs/cgroup/system.slice'
+        if os.path.isdir(slice_dir):
+            return {name: os.path.isdir(f'{slice_dir}/{name}.service') for name in services}
+        
+        # One state line is printed per unit, in the order given
+        result = subprocess.run(['systemctl', 'is-active'] + services, capture_output=True)
+        states = result.stdout.split()
+        return {name: i < len(states) and states[i] == b'active' for i, name in enumerate(services)}
     
     # --- NetworkManager Functions ---
     
+    def _create_nm_client(self):
+        """Create one libnm client that is reused for all NetworkManager reads"""
+        if NM is None:
+            return None
+        try:
+            client = NM.Client.new(None)
+            self.logger.info("Using libnm for NetworkManager queries")
+            return client
+        except Exception as e:
+            self.logger.warning(f"libnm unavailable, falling back to nmcli: {e}")
+            return None
+    
+    def _refresh_nm_client(self):
+        """Process pending D-Bus signals so the libnm object cache is current"""
+        context = self._nm.get_main_context()
+        while context.pending():
+            context.iteration(False)
+    
     def _get_ethernet_connection_name(self, interface="eth0"):
+        """Get actual ethernet connection name, cached for a few seconds per interface"""
+        now = time.monotonic()
+        cached = self._eth_name_cache.get(interface)
+        if cached and now - cached[0] < 5.0:
+            return cached[1]
+        
+        name = self._lookup_ethernet_connection_name(interface)
+        self._eth_name_cache[interface] = (now, name)
+        return name
+    
+    def _lookup_ethernet_connection_name(self, interface):
         """Get actual ethernet connection name from NetworkManager"""
+        if self._nm is not None:
+            try:
+                return self._get_ethernet_connection_name_libnm(interface)
+            except Exception as e:
+                self.logger.warning(f"libnm connection lookup failed, using nmcli: {e}")
+        
         try:
+            # Output is parsed as bytes, only the matching name gets decoded
             result = subprocess.run([
                 'nmcli', '-t', '-f', 'NAME,TYPE,DEVICE', 'connection', 'show'
-            ], capture_output=True, text=True, check=True)
-            
-            self.logger.info(f"Connection list output: {result.stdout}")
-            
-            for line in result.stdout.strip().split('\n'):
-                if line:
-                    parts = line.split(':')
-                    if len(parts) >= 3:
-                        name, conn_type, device = parts[:3]
-                        if conn_type == 'ethernet' and device == interface:
-                            self.logger.info(f"Found ethernet connection: '{name}' on {interface}")
-                            return name
-            
-            # Fallback: look for any ethernet connection  
-            for line in result.stdout.strip().split('\n'):
-                if line:
-                    parts = line.split(':')
-                    if len(parts) >= 2 and parts[1] == 'ethernet':
-                        self.logger.info(f"Found ethernet connection: '{parts[0]}' (fallback)")
-                        return parts[0]
+            ], capture_output=True, check=True)
+            
+            self.logger.debug("Connection list output: %s", result.stdout)
+            
+            # Single pass: exact device match wins, first ethernet connection is the fallback
+            iface = interface.encode()
+            fallback = None
+            for line in result.stdout.splitlines():
+                parts = line.split(b':', 3)
+                if len(parts) < 2 or parts[1] != b'ethernet':
+                    continue
+                if len(parts) >= 3 and parts[2] == iface:
+                    name = _nm_value(parts[0])
+                    self.logger.info(f"Found ethernet connection: '{name}' on {interface}")
+                    return name
+                if fallback is None:
+                    fallback = _nm_value(parts[0])
+            
+            if fallback is not None:
+                self.logger.info(f"Found ethernet connection: '{fallback}' (fallback)")
+                return fallback
             
             # Default fallback
             self.logger.info("Using default ethernet connection name")
@@ -238,22 +596,40 @@ class RPiConfigManager:
             self.logger.error(f"Unexpected error getting connection name: {e}")
             return "Wired connection 1"
     
+    def _get_ethernet_connection_name_libnm(self, interface):
+        """Get actual ethernet connection name from the shared libnm client"""
+        self._refresh_nm_client()
+        
+        device = self._nm.get_device_by_iface(interface)
+        active = device.get_active_connection() if device else None
+        if active and active.get_connection_type() == '802-3-ethernet':
+            self.logger.info(f"Found ethernet connection: '{active.get_id()}' on {interface}")
+            return active.get_id()
+        
+        # Fallback: look for any ethernet connection
+        for connection in self._nm.get_connections():
+            if connection.get_connection_type() == '802-3-ethernet':
+                self.logger.info(f"Found ethernet connection: '{connection.get_id()}' (fallback)")
+                return connection.get_id()
+        
+        # Default fallback
+        self.logger.info("Using default ethernet connection name")
+        return "Wired connection 1"
+    
     def _validate_network_config(self, static_ip, netmask, gateway=None):
         """Validate network configuration"""
         try:
-            import ipaddress
-            
             # Validate IP address
-            ip_obj = ipaddress.IPv4Address(static_ip)
+            ip_int = self._ipv4_to_int(static_ip)
             
             # Validate netmask and get CIDR
             cidr = self._netmask_to_cidr(netmask)
-            network = ipaddress.IPv4Network(f"{static_ip}/{cidr}", strict=False)
+            mask_int = (0xffffffff << (32 - cidr)) & 0xffffffff
+            network = f"{socket.inet_ntoa(struct.pack('>I', ip_int & mask_int))}/{cidr}"
             
             # Validate gateway is in same network (if provided)
             if gateway:
-                gateway_obj = ipaddress.IPv4Address(gateway)
-                if gateway_obj not in network:
+                if (self._ipv4_to_int(gateway) & mask_int) != (ip_int & mask_int):
                     raise ValueError(f"Gateway {gateway} not in network {network}")
             
             return True, f"Valid network configuration: {network}"
@@ -261,33 +637,44 @@ class RPiConfigManager:
         except Exception as e:
             return False, f"Invalid network config: {e}"
     
+    def _ipv4_to_int(self, address):
+        """Parse a dotted-quad IPv4 address into a 32-bit integer"""
+        try:
+            return struct.unpack('>I', socket.inet_pton(socket.AF_INET, address))[0]
+        except (OSError, TypeError):
+            raise ValueError(f"'{address}' does not appear to be an IPv4 address")
+    
     def _netmask_to_cidr(self, netmask):
         """Convert netmask to CIDR notation with validation"""
         try:
-            octets = netmask.split('.')
-            if len(octets) != 4:
-                raise ValueError(f"Invalid netmask format: {netmask}")
-            
-            cidr = 0
-            for octet in octets:
-                octet_int = int(octet)
-                if not 0 <= octet_int <= 255:
-                    raise ValueError(f"Invalid octet value: {octet_int}")
-                cidr += bin(octet_int).count('1')
-            
-            if not 8 <= cidr <= 30:
-                raise ValueError(f"Invalid CIDR: /{cidr}")
-                
-            return cidr
+            return self._parse_netmask(netmask)
         except Exception as e:
             self.logger.error(f"Netmask conversion error: {e}")
             raise ValueError(f"Invalid netmask: {netmask}")
     
-    def _cidr_to_netmask(self, cidr):
+    @staticmethod
+    @functools.lru_cache(maxsize=64)
+    def _parse_netmask(netmask):
+        """Netmask -> prefix length, raises ValueError (only valid masks are cached)"""
+        mask = struct.unpack('>I', socket.inet_pton(socket.AF_INET, netmask))[0]
+        
+        # The host part must be all ones, e.g. 255.0.255.0 is rejected
+        host = ~mask & 0xffffffff
+        if host & (host + 1):
+            raise ValueError(f"Non-contiguous netmask: {netmask}")
+        
+        cidr = bin(mask).count('1')
+        if not 8 <= cidr <= 30:
+            raise ValueError(f"Invalid CIDR: /{cidr}")
+            
+        return cidr
+    
+    @staticmethod
+    @functools.lru_cache(maxsize=33)
+    def _cidr_to_netmask(cidr):
         """Convert CIDR to netmask"""
         try:
-            mask = (0xffffffff >> (32 - cidr)) << (32 - cidr)
-            return f"{(mask >> 24) & 0xff}.{(mask >> 16) & 0xff}.{(mask >> 8) & 0xff}.{mask & 0xff}"
+            return socket.inet_ntoa(struct.pack('>I', (0xffffffff << (32 - cidr)) & 0xffffffff))
         except:
             return "255.255.255.0"
     
@@ -353,21 +740,15 @@ class RPiConfigManager:
             conn_name = self._get_ethernet_connection_name(interface)
             self.logger.info(f"Using connection name: '{conn_name}'")
             
+            # Switch to DHCP and clear any static settings in one call
             cmd = [
                 'nmcli', 'con', 'modify', conn_name,
-                'ipv4.method', 'auto'
-            ]
-            
-            # Clear any static settings
-            clear_cmds = [
-                ['nmcli', 'con', 'modify', conn_name, 'ipv4.addresses', ''],
-                ['nmcli', 'con', 'modify', conn_name, 'ipv4.gateway', ''],
-                ['nmcli', 'con', 'modify', conn_name, 'ipv4.dns', '']
+                'ipv4.method', 'auto',
+                'ipv4.addresses', '',
+                'ipv4.gateway', '',
+                'ipv4.dns', ''
             ]
             
-            for clear_cmd in clear_cmds:
-                subprocess.run(clear_cmd, capture_output=True, text=True)
-            
             result = subprocess.run(cmd, capture_output=True, text=True, check=True)
             self.logger.info(f"DHCP configured for connection: '{conn_name}'")
             
@@ -398,14 +779,9 @@ class RPiConfigManager:
     def read_current_ip_config(self):
         """Read current IP configuration based on detected network method"""
         try:
-            if self.network_method == 'networkmanager':
-                return self._read_networkmanager_config()
-            elif self.network_method == 'dhcpcd':
-                return self._read_dhcpcd_config()
-            elif self.network_method == 'interfaces':
-                return self._read_interfaces_config()
-            else:
+            if self._read_fn is None:
                 return False, f"Unsupported network method: {self.network_method}"
+            return self._read_fn()
                 
         except Exception as e:
             self.logger.error(f"Error reading network config: {e}")
@@ -413,100 +789,133 @@ class RPiConfigManager:
     
     def _read_networkmanager_config(self):
         """Read NetworkManager configuration"""
+        if self._nm is not None:
+            try:
+                return self._read_networkmanager_config_libnm()
+            except Exception as e:
+                self.logger.warning(f"libnm read failed, using nmcli: {e}")
+        
         try:
-            # Get device status
-            result = subprocess.run(['nmcli', '-t', '-f', 'DEVICE,TYPE,STATE,CONNECTION', 'device', 'status'], 
-                                   capture_output=True, text=True, check=True)
-            
-            self.logger.info(f"Device status output: {result.stdout}")
+            # Type, state, connection and current IP of all devices in one call
+            # Output is parsed as bytes, only the fields we use get decoded
+            result = subprocess.run([
+                'nmcli', '-t', '-f',
+                'GENERAL.DEVICE,GENERAL.TYPE,GENERAL.STATE,GENERAL.CONNECTION,IP4.ADDRESS',
+                'device', 'show'
+            ], capture_output=True, check=True)
+            
+            self.logger.debug("Device show output: %s", result.stdout)
+            
+            # One block of fields per device, each starting with GENERAL.DEVICE
+            devices = []
+            for line in result.stdout.splitlines():
+                key, sep, value = line.partition(b':')
+                if not sep:
+                    continue
+                if key == b'GENERAL.DEVICE':
+                    devices.append({})
+                if devices:
+                    devices[-1].setdefault(key, value)
             
             interfaces = {}
-            for line in result.stdout.strip().split('\n'):
-                if line:
-                    parts = line.split(':')
-                    if len(parts) >= 4:
-                        device, type_name, state, connection = parts[:4]
-                        if type_name in ['ethernet', 'wifi']:
-                            interfaces[device] = {
-                                'state': state,
-                                'connection': connection if connection else 'none',
-                                'type': type_name,
-                                'method': 'dhcp'  # Default
-                            }
-                            
-                            self.logger.info(f"Processing device {device}: state={state}, connection='{connection}'")
-                            
-                            # If ethernet has no active connection, try to find configured connection
-                            if device == 'eth0' and (not connection or connection == '--'):
-                                self.logger.info("eth0 has no active connection, looking for ethernet connections...")
-                                try:
-                                    # Find ethernet connections
-                                    conn_result = subprocess.run([
-                                        'nmcli', '-t', '-f', 'NAME,TYPE', 'con', 'show'
-                                    ], capture_output=True, text=True, check=True)
-                                    
-                                    for conn_line in conn_result.stdout.strip().split('\n'):
-                                        if conn_line:
-                                            conn_parts = conn_line.split(':')
-                                            if len(conn_parts) >= 2 and conn_parts[1] == 'ethernet':
-                                                connection = conn_parts[0]
-                                                interfaces[device]['connection'] = connection
-                                                self.logger.info(f"Found ethernet connection: '{connection}'")
-                                                break
-                                except subprocess.CalledProcessError as e:
-                                    self.logger.error(f"Failed to find ethernet connections: {e}")
-                            
-                            # Get detailed connection info if connection exists
-                            if connection and connection != '--' and connection != '':
-                                try:
-                                    # Get connection details
-                                    con_result = subprocess.run([
-                                        'nmcli', '-t', '-f', 'ipv4.method,ipv4.addresses,ipv4.gateway,ipv4.dns', 
-                                        'con', 'show', connection
-                                    ], capture_output=True, text=True, check=True)
-                                    
-                                    self.logger.info(f"Connection '{connection}' details: {con_result.stdout}")
-                                    
-                                    for con_line in con_result.stdout.strip().split('\n'):
-                                        if ':' in con_line:
-                                            key, value = con_line.split(':', 1)
-                                            if key == 'ipv4.method':
-                                                interfaces[device]['method'] = 'static' if value == 'manual' else 'dhcp'
-                                                self.logger.info(f"Device {device} method: {interfaces[device]['method']}")
-                                            elif key == 'ipv4.addresses' and value:
-                                                addr = value.split(',')[0]  # Take first address
-                                                if '/' in addr:
-                                                    ip_addr = addr.split('/')[0]
-                                                    cidr = addr.split('/')[1]
-                                                    interfaces[device]['address'] = ip_addr
-                                                    interfaces[device]['cidr'] = cidr
-                                                    interfaces[device]['netmask'] = self._cidr_to_netmask(int(cidr))
-                                                    self.logger.info(f"Device {device} configured IP: {ip_addr}/{cidr}")
-                                            elif key == 'ipv4.gateway' and value:
-                                                interfaces[device]['gateway'] = value
-                                                self.logger.info(f"Device {device} gateway: {value}")
-                                            elif key == 'ipv4.dns' and value:
-                                                interfaces[device]['dns-nameservers'] = value.replace(';', ' ')
-                                                self.logger.info(f"Device {device} DNS: {interfaces[device]['dns-nameservers']}")
-                                except subprocess.CalledProcessError as e:
-                                    self.logger.error(f"Failed to get connection details for '{connection}': {e}")
-                            
-                            # Get current active IP if connected
-                            if state == 'connected':
-                                try:
-                                    ip_result = subprocess.run(['nmcli', '-t', '-f', 'IP4.ADDRESS', 'device', 'show', device],
-                                                             capture_output=True, text=True, check=True)
-                                    
-                                    if ip_result.stdout.strip():
-                                        for ip_line in ip_result.stdout.strip().split('\n'):
-                                            if ip_line.startswith('IP4.ADDRESS[1]'):
-                                                ip_addr_full = ip_line.split(':')[1].strip()
-                                                if '/' in ip_addr_full:
-                                                    interfaces[device]['current_address'] = ip_addr_full.split('/')[0]
-                                                    self.logger.info(f"Device {device} current IP: {interfaces[device]['current_address']}")
-                                                break
-                                except subprocess.CalledProcessError as e:
-                                    self.logger.error(f"Failed to get current IP for {device}: {e}")
+            connection_devices = {}
+            for info in devices:
+                type_name = info.get(b'GENERAL.TYPE', b'')
+                if type_name not in (b'ethernet', b'wifi'):
+                    continue
+                type_name = type_name.decode()
+                device = _nm_value(info.get(b'GENERAL.DEVICE', b''))
+                
+                # GENERAL.STATE looks like "100 (connected)"
+                state = _nm_value(info.get(b'GENERAL.STATE', b''))
+                if '(' in state:
+                    state = state[state.find('(') + 1:state.rfind(')')]
+                connection = _nm_value(info.get(b'GENERAL.CONNECTION', b''))
+                
+                interfaces[device] = {
+                    'state': state,
+                    'connection': connection if connection else 'none',
+                    'type': type_name,
+                    'method': 'dhcp'  # Default
+                }
+                
+                self.logger.info(f"Processing device {device}: state={state}, connection='{connection}'")
+                
+                # If ethernet has no active connection, try to find configured connection
+                if device == 'eth0' and (not connection or connection == '--'):
+                    self.logger.info("eth0 has no active connection, looking for ethernet connections...")
+                    try:
+                        # Find ethernet connections
+                        conn_result = subprocess.run([
+                            'nmcli', '-t', '-f', 'NAME,TYPE', 'con', 'show'
+                        ], capture_output=True, check=True)
+                        
+                        for conn_line in conn_result.stdout.splitlines():
+                            conn_parts = conn_line.split(b':')
+                            if len(conn_parts) >= 2 and conn_parts[1] == b'ethernet':
+                                connection = _nm_value(conn_parts[0])
+                                interfaces[device]['connection'] = connection
+                                self.logger.info(f"Found ethernet connection: '{connection}'")
+                                break
+                    except subprocess.CalledProcessError as e:
+                        self.logger.error(f"Failed to find ethernet connections: {e}")
+                
+                if connection and connection != '--':
+                    connection_devices.setdefault(connection, []).append(device)
+                
+                # Current active IP if connected
+                if state == 'connected':
+                    ip_addr_full = _nm_value(info.get(b'IP4.ADDRESS[1]', b''))
+                    if '/' in ip_addr_full:
+                        interfaces[device]['current_address'] = ip_addr_full.split('/')[0]
+                        self.logger.info(f"Device {device} current IP: {interfaces[device]['current_address']}")
+            
+            # Get detailed info of all connections in one call, connection.id
+            # marks the start of each connection's fields
+            if connection_devices:
+                details_cmd = ['nmcli', '-t', '-f',
+                               'connection.id,ipv4.method,ipv4.addresses,ipv4.gateway,ipv4.dns',
+                               'con', 'show']
+                for connection in connection_devices:
+                    details_cmd += ['id', connection]
+                
+                try:
+                    con_result = subprocess.run(details_cmd, capture_output=True, check=True)
+                    
+                    self.logger.debug("Connection details: %s", con_result.stdout)
+                    
+                    targets = []
+                    for con_line in con_result.stdout.splitlines():
+                        key, sep, value = con_line.partition(b':')
+                        if not sep:
+                            continue
+                        key = key.decode()
+                        value = _nm_value(value)
+                        if key == 'connection.id':
+                            targets = connection_devices.get(value, [])
+                            continue
+                        
+                        for device in targets:
+                            if key == 'ipv4.method':
+                                interfaces[device]['method'] = 'static' if value == 'manual' else 'dhcp'
+                                self.logger.info(f"Device {device} method: {interfaces[device]['method']}")
+                            elif key == 'ipv4.addresses' and value:
+                                addr = value.split(',')[0]  # Take first address
+                                if '/' in addr:
+                                    ip_addr = addr.split('/')[0]
+                                    cidr = addr.split('/')[1]
+                                    interfaces[device]['address'] = ip_addr
+                                    interfaces[device]['cidr'] = cidr
+                                    interfaces[device]['netmask'] = self._cidr_to_netmask(int(cidr))
+                                    self.logger.info(f"Device {device} configured IP: {ip_addr}/{cidr}")
+                            elif key == 'ipv4.gateway' and value:
+                                interfaces[device]['gateway'] = value
+                                self.logger.info(f"Device {device} gateway: {value}")
+                            elif key == 'ipv4.dns' and value:
+                                interfaces[device]['dns-nameservers'] = value.replace(';', ' ')
+                                self.logger.info(f"Device {device} DNS: {interfaces[device]['dns-nameservers']}")
+                except subprocess.CalledProcessError as e:
+                    self.logger.error(f"Failed to get connection details for {list(connection_devices)}: {e}")
             
             self.logger.info(f"Final interfaces config: {interfaces}")
             return True, interfaces
@@ -518,6 +927,64 @@ class RPiConfigManager:
             self.logger.error(f"Error reading NetworkManager config: {e}")
             return False, f"Error reading NetworkManager config: {e}"
     
+    def _read_networkmanager_config_libnm(self):
+        """Read NetworkManager configuration from the shared libnm client"""
+        self._refresh_nm_client()
+        
+        interfaces = {}
+        for dev in self._nm.get_devices():
+            dev_type = dev.get_device_type()
+            if dev_type == NM.DeviceType.ETHERNET:
+                type_name = 'ethernet'
+            elif dev_type == NM.DeviceType.WIFI:
+                type_name = 'wifi'
+            else:
+                continue
+            
+            device = dev.get_iface()
+            state_nick = dev.get_state().value_nick
+            state = NM_DEVICE_STATES.get(state_nick, state_nick)
+            active = dev.get_active_connection()
+            profile = active.get_connection() if active else None
+            
+            interfaces[device] = {
+                'state': state,
+                'connection': active.get_id() if active else 'none',
+                'type': type_name,
+                'method': 'dhcp'  # Default
+            }
+            
+            # If ethernet has no active connection, use the configured one
+            if device == 'eth0' and profile is None:
+                for connection in self._nm.get_connections():
+                    if connection.get_connection_type() == '802-3-ethernet':
+                        profile = connection
+                        interfaces[device]['connection'] = connection.get_id()
+                        break
+            
+            s_ip4 = profile.get_setting_ip4_config() if profile else None
+            if s_ip4 is not None:
+                interfaces[device]['method'] = 'static' if s_ip4.get_method() == 'manual' else 'dhcp'
+                if s_ip4.get_num_addresses():
+                    addr = s_ip4.get_address(0)  # Take first address
+                    interfaces[device]['address'] = addr.get_address()
+                    interfaces[device]['cidr'] = str(addr.get_prefix())
+                    interfaces[device]['netmask'] = self._cidr_to_netmask(addr.get_prefix())
+                if s_ip4.get_gateway():
+                    interfaces[device]['gateway'] = s_ip4.get_gateway()
+                if s_ip4.get_num_dns():
+                    interfaces[device]['dns-nameservers'] = ' '.join(
+                        s_ip4.get_dns(i) for i in range(s_ip4.get_num_dns())
+                    )
+            
+            # Current active IP if connected
+            ip4_config = dev.get_ip4_config()
+            if state == 'connected' and ip4_config and ip4_config.get_addresses():
+                interfaces[device]['current_address'] = ip4_config.get_addresses()[0].get_address()
+        
+        self.logger.info(f"Final interfaces config (libnm): {interfaces}")
+        return True, interfaces
+    
     def _read_dhcpcd_config(self):
         """Read dhcpcd configuration"""
         try:
@@ -573,32 +1040,22 @@ class RPiConfigManager:
         interfaces = {}
         current_iface = None
         try:
-            for line in content.splitlines():
-                line = line.strip()
-
-                if line.startswith("auto "):
-                    current_iface = line.split()[1]
+            for match in INTERFACES_LINE_RE.finditer(content):
+                auto_iface, iface_name, method, key, value = match.groups()
+                
+                if auto_iface:
+                    current_iface = auto_iface
                     if current_iface not in interfaces:
                         interfaces[current_iface] = {}
-
-                elif line.startswith("iface "):
-                    parts = line.split()
-                    if len(parts) < 4:
-                        continue
-                    
-                    iface_name = parts[1]
+                
+                elif iface_name:
                     if iface_name not in interfaces:
                         interfaces[iface_name] = {}
-                    interfaces[iface_name]["method"] = parts[3]
+                    interfaces[iface_name]["method"] = method
                     current_iface = iface_name
-
-                elif current_iface and line:
-                    try:
-                        key, value = line.split(maxsplit=1)
-                        if key in ["address", "netmask", "gateway", "dns-nameservers"]:
-                            interfaces[current_iface][key] = value
-                    except ValueError:
-                        pass
+                
+                elif current_iface and value:
+                    interfaces[current_iface][key] = value
                         
             return interfaces
         except Exception as e:
@@ -608,14 +1065,9 @@ class RPiConfigManager:
     def set_static_ip(self, interface="eth0", ip="192.168.0.100", netmask="255.255.255.0", gateway="192.168.0.1", dns="8.8.8.8 8.8.4.4"):
         """Set static IP for interface using detected network method"""
         try:
-            if self.network_method == 'networkmanager':
-                return self._set_networkmanager_static(interface, ip, netmask, gateway, dns)
-            elif self.network_method == 'dhcpcd':
-                return self._set_dhcpcd_static(interface, ip, netmask, gateway, dns)
-            elif self.network_method == 'interfaces':
-                return self._set_interfaces_static(interface, ip, netmask, gateway, dns)
-            else:
+            if self._set_static_fn is None:
                 return False, f"Unsupported network method: {self.network_method}"
+            return self._set_static_fn(interface, ip, netmask, gateway, dns)
                 
         except Exception as e:
             self.logger.error(f"Error setting static IP: {e}")
@@ -624,14 +1076,9 @@ class RPiConfigManager:
     def set_dynamic_ip(self, interface="eth0"):
         """Set dynamic IP (DHCP) for interface using detected network method"""
         try:
-            if self.network_method == 'networkmanager':
-                return self._set_networkmanager_dhcp(interface)
-            elif self.network_method == 'dhcpcd':
-                return self._set_dhcpcd_dhcp(interface)
-            elif self.network_method == 'interfaces':
-                return self._set_interfaces_dhcp(interface)
-            else:
+            if self._set_dhcp_fn is None:
                 return False, f"Unsupported network method: {self.network_method}"
+            return self._set_dhcp_fn(interface)
                 
         except Exception as e:
             self.logger.error(f"Error setting dynamic IP: {e}")
@@ -639,42 +1086,43 @@ class RPiConfigManager:
     
     # --- dhcpcd Methods ---
     
+    def _remove_dhcpcd_interface_block(self, content, interface):
+        """Cut an interface block (and the comment we put above it) out of dhcpcd.conf"""
+        # The block runs from "interface <name>" up to the next interface line
+        # (keeping the blank line/comments right above it) or EOF
+        block_re = re.compile(
+            rf'(?:^\n)?(?:^# Static IP for {re.escape(interface)}\n)?'
+            rf'^[ \t]*interface[ \t]+{re.escape(interface)}(?!\S).*?'
+            rf'(?=(?:^\n)?(?:^#[^\n]*\n)*^[ \t]*interface[ \t]|\Z)',
+            re.MULTILINE | re.DOTALL
+        )
+        return block_re.sub('', content)
+    
     def _set_dhcpcd_static(self, interface, ip, netmask, gateway, dns):
         """Set static IP using dhcpcd"""
         try:
-            if not os.path.exists(self.dhcpcd_file):
-                return False, f"dhcpcd.conf not found at {self.dhcpcd_file}"
-            
             valid, msg = self._validate_network_config(ip, netmask, gateway)
             if not valid:
                 return False, msg
             
-            with open(self.dhcpcd_file, 'r') as f:
-                config_lines = f.readlines()
+            try:
+                with open(self.dhcpcd_file, 'r') as f:
+                    content = f.read()
+            except FileNotFoundError:
+                return False, f"dhcpcd.conf not found at {self.dhcpcd_file}"
             
             # Remove existing interface config
-            new_lines = []
-            skip_interface = False
-            for line in config_lines:
-                if line.strip().startswith(f'interface {interface}'):
-                    skip_interface = True
-                    continue
-                elif line.strip().startswith('interface ') and skip_interface:
-                    skip_interface = False
-                    new_lines.append(line)
-                elif not skip_interface:
-                    new_lines.append(line)
+            content = self._remove_dhcpcd_interface_block(content, interface)
             
             # Add new static config
-            new_lines.append(f'\n# Static IP for {interface}\n')
-            new_lines.append(f'interface {interface}\n')
-            new_lines.append(f'static ip_address={ip}/{self._netmask_to_cidr(netmask)}\n')
-            new_lines.append(f'static routers={gateway}\n')
+            content += f'\n# Static IP for {interface}\n'
+            content += f'interface {interface}\n'
+            content += f'static ip_address={ip}/{self._netmask_to_cidr(netmask)}\n'
+            content += f'static routers={gateway}\n'
             if dns:
-                new_lines.append(f'static domain_name_servers={dns}\n')
+                content += f'static domain_name_servers={dns}\n'
             
-            with open(self.dhcpcd_file, 'w') as f:
-                f.writelines(new_lines)
+            self._write_file_atomic(self.dhcpcd_file, content)
             
             subprocess.run(['sudo', 'systemctl', 'restart', 'dhcpcd'], 
                           check=True, capture_output=True)
@@ -688,27 +1136,21 @@ class RPiConfigManager:
     def _set_dhcpcd_dhcp(self, interface):
         """Set DHCP using dhcpcd"""
         try:
-            if not os.path.exists(self.dhcpcd_file):
+            try:
+                with open(self.dhcpcd_file, 'r') as f:
+                    content = f.read()
+            except FileNotFoundError:
                 return False, f"dhcpcd.conf not found at {self.dhcpcd_file}"
             
-            with open(self.dhcpcd_file, 'r') as f:
-                config_lines = f.readlines()
-            
             # Remove existing interface config
-            new_lines = []
-            skip_interface = False
-            for line in config_lines:
-                if line.strip().startswith(f'interface {interface}'):
-                    skip_interface = True
-                    continue
-                elif line.strip().startswith('interface ') and skip_interface:
-                    skip_interface = False
-                    new_lines.append(line)
-                elif not skip_interface:
-                    new_lines.append(line)
+            new_content = self._remove_dhcpcd_interface_block(content, interface)
+            
+            # No static block for this interface, dhcpcd is already doing DHCP
+            if new_content == content:
+                self.logger.info(f"dhcpcd already uses DHCP for {interface}")
+                return True, f"DHCP already set for {interface} using dhcpcd"
             
-            with open(self.dhcpcd_file, 'w') as f:
-                f.writelines(new_lines)
+            self._write_file_atomic(self.dhcpcd_file, new_content)
             
             subprocess.run(['sudo', 'systemctl', 'restart', 'dhcpcd'], 
                           check=True, capture_output=True)
@@ -724,15 +1166,12 @@ class RPiConfigManager:
     def _set_interfaces_static(self, interface, ip, netmask, gateway, dns):
         """Set static IP using /etc/network/interfaces"""
         try:
-            if not os.path.exists('/etc/network/interfaces'):
-                return False, "/etc/network/interfaces not found"
-            
             valid, msg = self._validate_network_config(ip, netmask, gateway)
             if not valid:
                 return False, msg
             
-            success, message = self.change_ip_configuration(interface, "static", ip, netmask, gateway, dns)
-            if success:
+            success, message, changed = self.change_ip_configuration(interface, "static", ip, netmask, gateway, dns)
+            if success and changed:
                 self.logger.info(f"Static IP set for {interface}: {ip}")
                 restart_success, restart_msg = self.restart_networking_service()
                 return restart_success, f"{message} {restart_msg}"
@@ -744,11 +1183,8 @@ class RPiConfigManager:
     def _set_interfaces_dhcp(self, interface):
         """Set DHCP using /etc/network/interfaces"""
         try:
-            if not os.path.exists('/etc/network/interfaces'):
-                return False, "/etc/network/interfaces not found"
-            
-            success, message = self.change_ip_configuration(interface, "dhcp")
-            if success:
+            success, message, changed = self.change_ip_configuration(interface, "dhcp")
+            if success and changed:
                 self.logger.info(f"Dynamic IP set for {interface}")
                 restart_success, restart_msg = self.restart_networking_service()
                 return restart_success, f"{message} {restart_msg}"
@@ -758,91 +1194,96 @@ class RPiConfigManager:
             return False, f"Error setting interfaces DHCP: {e}"
     
     def change_ip_configuration(self, interface, method, static_ip=None, netmask=None, gateway=None, dns=None):
-        """Changes IP configuration in /etc/network/interfaces"""
+        """Changes IP configuration in /etc/network/interfaces, returns (success, message, file changed)"""
         try:
             interfaces_file = '/etc/network/interfaces'
             
-            if not os.access(interfaces_file, os.W_OK):
-                return False, f"No write permission to {interfaces_file}. Run with sudo."
-            
-            backup_file = f"{interfaces_file}.backup.{int(time.time())}"
-            shutil.copy2(interfaces_file, backup_file)
-            
-            with open(interfaces_file, 'r') as file:
-                lines = file.readlines()
+            stanza = []
+            if method == "static":
+                if not all([static_ip, netmask, gateway]):
+                    return False, "Missing static IP parameters (address, netmask, gateway).", False
+                stanza = [f"\taddress {static_ip}\n", f"\tnetmask {netmask}\n", f"\tgateway {gateway}\n"]
+                if dns:
+                    stanza.append(f"\tdns-nameservers {dns}\n")
 
-            new_lines = []
-            in_target_iface_section = False
+            target_header = f"iface {interface} "
             
-            for line in lines:
-                stripped_line = line.strip()
-
-                if stripped_line.startswith(f"auto {interface}"):
-                    new_lines.append(line)
-
-                elif stripped_line.startswith(f"iface {interface}"):
-                    in_target_iface_section = True
-                    new_lines.append(f"iface {interface} inet {method}\n")
+            def edited_lines(lines):
+                in_target = False
+                for line in lines:
+                    stripped_line = line.strip()
                     
-                    if method == "static":
-                        if not all([static_ip, netmask, gateway]):
-                            return False, "Missing static IP parameters (address, netmask, gateway)."
-                        new_lines.append(f"\taddress {static_ip}\n")
-                        new_lines.append(f"\tnetmask {netmask}\n")
-                        new_lines.append(f"\tgateway {gateway}\n")
-                        if dns:
-                            new_lines.append(f"\tdns-nameservers {dns}\n")
-                
-                elif in_target_iface_section and (
-                    stripped_line.startswith("address ") or 
-                    stripped_line.startswith("netmask ") or 
-                    stripped_line.startswith("gateway ") or
-                    stripped_line.startswith("dns-nameservers ") or
-                    stripped_line.startswith("pre-up ") or
-                    stripped_line.startswith("post-down ") or
-                    stripped_line.startswith("iface ")
-                ):
-                    if stripped_line.startswith("iface ") and stripped_line != f"iface {interface} inet {method}":
-                        in_target_iface_section = False
-                        new_lines.append(line)
-                elif not in_target_iface_section:
-                    new_lines.append(line)
-            
-            with open(interfaces_file, 'w') as file:
-                file.writelines(new_lines)
+                    if stripped_line.startswith(INTERFACES_STANZA_PREFIXES):
+                        in_target = stripped_line.startswith(target_header)
+                        if in_target:
+                            yield f"iface {interface} inet {method}\n"
+                            yield from stanza
+                            continue
+                    elif in_target and stripped_line.startswith(INTERFACES_DROP_PREFIXES):
+                        continue
+                    yield line
+            
+            # Stream the edit straight into the temp file that replaces the original,
+            # the previous versions are kept as a ring of 3 backups
+            with open(interfaces_file, 'r') as file:
+                changed = self._write_file_atomic(interfaces_file, edited_lines(file), backups=3)
 
-            return True, "IP configuration updated successfully."
+            if not changed:
+                return True, "IP configuration already up to date.", False
+            return True, "IP configuration updated successfully.", True
             
+        except FileNotFoundError:
+            return False, f"{interfaces_file} not found", False
+        except PermissionError:
+            return False, f"No write permission to {interfaces_file}. Run with sudo.", False
         except Exception as e:
             self.logger.error(f"Error updating IP configuration: {e}")
-            return False, str(e)
+            return False, str(e), False
 
     def restart_networking_service(self):
+        """Schedule a networking restart, requests within 0.5 s share a single restart"""
+        with self._network_restart_lock:
+            if self._network_restart_timer is None:
+                # Non-daemon, so an accepted change is still applied on interpreter exit
+                self._network_restart_timer = threading.Timer(0.5, self._run_scheduled_network_restart)
+                self._network_restart_timer.start()
+        return True, "Network service restart scheduled."
+    
+    def _run_scheduled_network_restart(self):
+        """Timer callback of restart_networking_service"""
+        with self._network_restart_lock:
+            self._network_restart_timer = None
+        
+        success, message = self._restart_networking_now()
+        if not success:
+            self._publish("network_response", {"action": "restart_network", "error": message}, status="error")
+    
+    def _restart_networking_now(self):
         """Restarts the appropriate networking service based on detected method"""
         try:
             if self.network_method == 'networkmanager':
                 subprocess.run(["sudo", "systemctl", "restart", "NetworkManager"], 
-                              check=True, text=True, capture_output=True)
+                              check=True, text=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
                 self.logger.info("NetworkManager service restarted successfully")
                 return True, "NetworkManager service restarted successfully."
                 
             elif self.network_method == 'dhcpcd':
                 subprocess.run(["sudo", "systemctl", "restart", "dhcpcd"], 
-                              check=True, text=True, capture_output=True)
+                              check=True, text=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
                 self.logger.info("dhcpcd service restarted successfully")
                 return True, "dhcpcd service restarted successfully."
                 
             elif self.network_method == 'interfaces':
                 try:
                     subprocess.run(["sudo", "systemctl", "restart", "networking"], 
-                                  check=True, text=True, capture_output=True)
+                                  check=True, text=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
                     self.logger.info("networking service restarted successfully")
                     return True, "networking service restarted successfully."
                 except subprocess.CalledProcessError:
                     self.logger.info("networking service not found, using ifdown/ifup")
-                    subprocess.run(["sudo", "ifdown", "eth0"], capture_output=True)
+                    subprocess.run(["sudo", "ifdown", "eth0"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
                     time.sleep(2)
-                    subprocess.run(["sudo", "ifup", "eth0"], capture_output=True)
+                    subprocess.run(["sudo", "ifup", "eth0"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
                     return True, "Network interface restarted with ifdown/ifup."
             else:
                 return False, f"Unknown network method: {self.network_method}"
@@ -858,12 +1299,13 @@ class RPiConfigManager:
     
     # --- WiFi Management Functions ---
     
-    def run_nmcli_command(self, command_args, description):
-        """Helper to run nmcli commands and handle output/errors"""
+    def run_nmcli_command(self, command_args, description, capture_stdout=True):
+        """Helper to run nmcli commands and handle output/errors (stdout is discarded if not captured)"""
         try:
-            result = subprocess.run(['nmcli'] + command_args, stdout=subprocess.PIPE, 
+            result = subprocess.run(['nmcli'] + command_args,
+                                   stdout=subprocess.PIPE if capture_stdout else subprocess.DEVNULL,
                                    stderr=subprocess.PIPE, text=True, check=True, timeout=15)
-            return True, result.stdout.strip()
+            return True, result.stdout.strip() if capture_stdout else ''
         except subprocess.CalledProcessError as e:
             error_msg = f"Failed to {description}: {e.stderr.strip()}"
             self.logger.error(error_msg)
@@ -881,6 +1323,45 @@ class RPiConfigManager:
             self.logger.error(error_msg)
             return False, error_msg
 
+    def run_nmcli_commands(self, commands, timeout=15):
+        """Run independent nmcli commands concurrently, results are returned in order"""
+        procs = []
+        for command_args, description in commands:
+            try:
+                procs.append(subprocess.Popen(['nmcli'] + command_args, stdout=subprocess.PIPE,
+                                              stderr=subprocess.PIPE, text=True))
+            except FileNotFoundError:
+                procs.append(None)
+        
+        # All commands share one deadline since they run side by side
+        deadline = time.monotonic() + timeout
+        results = []
+        for (command_args, description), proc in zip(commands, procs):
+            if proc is None:
+                error_msg = "nmcli command not found. NetworkManager might not be installed."
+                self.logger.error(error_msg)
+                results.append((False, error_msg))
+                continue
+            
+            try:
+                stdout, stderr = proc.communicate(timeout=max(0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.communicate()
+                error_msg = f"Command timed out while trying to {description}."
+                self.logger.error(error_msg)
+                results.append((False, error_msg))
+                continue
+            
+            if proc.returncode != 0:
+                error_msg = f"Failed to {description}: {stderr.strip()}"
+                self.logger.error(error_msg)
+                results.append((False, error_msg))
+            else:
+                results.append((True, stdout.strip()))
+        
+        return results
+
     def scan_wifi(self):
         """Scans for available Wi-Fi networks"""
         self.logger.info("Scanning for Wi-Fi networks...")
@@ -889,21 +1370,20 @@ class RPiConfigManager:
         current_ssid = None
         if current_status.get("connected") and current_status.get("current_network"):
             current_ssid = current_status["current_network"]["ssid"]
-        success, filtered_output = self.run_nmcli_command(['-t', '-f', 'SSID,SECURITY,SIGNAL,FREQ', 'dev', 'wifi', 'list', '--rescan', 'yes'], 
+        success, filtered_output = self.run_nmcli_command(['-t', '-f', 'SSID,SECURITY,SIGNAL', 'dev', 'wifi', 'list', '--rescan', 'yes'], 
                                                  "scan Wi-Fi networks")
         if not success:
             return []
         
-        wifi_networks = []
+        ranked_networks = []  # (signal as int, network info)
         seen_ssids = set()
+        saved_ssids = set(self._fetch_saved_wifi_connections())
 
-        for filtered_line in filtered_output.splitlines():
-            parts = filtered_line.split(':', 3)
-            if len(parts) >= 4:
+        for parts in _nmcli_rows(filtered_output):
+            if len(parts) == 3:
                 ssid = parts[0].strip()
                 security = parts[1].strip()
                 signal = parts[2].strip()
-                frequency = parts[3].strip()
                 
                 if ssid and ssid not in seen_ssids:
                     seen_ssids.add(ssid)
@@ -912,15 +1392,15 @@ class RPiConfigManager:
                         "ssid": ssid, 
                         "security": security,
                         "signal": signal,
-                        "frequency": frequency,
                         "is_current": ssid == current_ssid,
-                        "is_saved": any(saved["ssid"] == ssid for saved in current_status.get("saved_networks", []))
+                        "is_saved": ssid in saved_ssids
                     }
                     
-                    wifi_networks.append(network_info)
+                    ranked_networks.append((int(signal) if signal.isdigit() else 0, network_info))
 
         # Sort by signal strength (descending)
-        wifi_networks.sort(key=lambda x: int(x["signal"]) if x["signal"].isdigit() else 0, reverse=True)
+        ranked_networks.sort(key=itemgetter(0), reverse=True)
+        wifi_networks = [network_info for _, network_info in ranked_networks]
         
         self.logger.info(f"Found {len(wifi_networks)} Wi-Fi networks.")
         return wifi_networks
@@ -928,7 +1408,9 @@ class RPiConfigManager:
     def disconnect_current_wifi(self):
         """Disconnects any active Wi-Fi connection on wlan0"""
         self.logger.info("Attempting to disconnect current Wi-Fi connection on wlan0...")
-        success, message = self.run_nmcli_command(['device', 'disconnect', 'wlan0'], "disconnect current Wi-Fi")
+        success, message = self.run_nmcli_command(['device', 'disconnect', 'wlan0'], "disconnect current Wi-Fi",
+                                                 capture_stdout=False)
+        self._invalidate_wifi_status()
         
         if not success and "not connected" not in message.lower():
             self.logger.warning(f"Failed to disconnect Wi-Fi: {message}")
@@ -945,31 +1427,45 @@ class RPiConfigManager:
         if not disconnect_success and "not connected" not in disconnect_msg.lower():
             return False, disconnect_msg
 
-        time.sleep(2)
+        # Give wlan0 up to 2 s to leave the connected state
+        self._poll_wlan0(lambda output: 'GENERAL.STATE:100 ' not in output, timeout=2.0)
 
         if password:
             connect_success, connect_msg = self.run_nmcli_command(['dev', 'wifi', 'connect', ssid, 'password', password], 
-                                                                 f"connect to {ssid}")
+                                                                 f"connect to {ssid}", capture_stdout=False)
         else:
             connect_success, connect_msg = self.run_nmcli_command(['dev', 'wifi', 'connect', ssid], 
-                                                                 f"connect to {ssid} (no password)")
+                                                                 f"connect to {ssid} (no password)",
+                                                                 capture_stdout=False)
+        self._invalidate_wifi_status()
         
         if not connect_success:
             return False, connect_msg
 
         self.logger.info(f"Successfully connected to {ssid}")
-        time.sleep(3)
 
-        ip_success, ip_output = self.run_nmcli_command(['device', 'show', 'wlan0'], "get IP address from wlan0")
-        if ip_success:
-            import re
-            match = re.search(r"IP4\.ADDRESS\[1\]:\s*(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})/\d+", ip_output)
-            ip_address = match.group(1) if match else "IP not found"
-        else:
-            ip_address = "IP not found"
+        # Wait (at most 8 s) until wlan0 is connected and has an address
+        ip_output = self._poll_wlan0(
+            lambda output: 'GENERAL.STATE:100 ' in output and IPV4_ADDRESS_RE.search(output) is not None,
+            timeout=8.0
+        )
+        match = IPV4_ADDRESS_RE.search(ip_output)
+        ip_address = match.group(1) if match else "IP not found"
 
         return True, ip_address
 
+    def _poll_wlan0(self, done, timeout, interval=0.5):
+        """Poll wlan0 state and address until done(output) is true or timeout, returns the last output"""
+        deadline = time.monotonic() + timeout
+        while True:
+            success, output = self.run_nmcli_command(['-t', '-f', 'GENERAL.STATE,IP4.ADDRESS', 'device', 'show', 'wlan0'],
+                                                     "get wlan0 state")
+            if not success:
+                output = ''
+            if (success and done(output)) or time.monotonic() >= deadline:
+                return output
+            time.sleep(interval)
+
     def delete_wifi(self, ssid):
         """Deletes a Wi-Fi connection by SSID"""
         self.logger.info(f"Attempting to delete Wi-Fi connection: {ssid}")
@@ -980,8 +1476,7 @@ class RPiConfigManager:
             return False, output
 
         uuid_to_delete = None
-        for line in output.splitlines():
-            parts = line.split(':')
+        for parts in _nmcli_rows(output):
             if len(parts) >= 2 and parts[1] == ssid:
                 uuid_to_delete = parts[0]
                 break
@@ -990,7 +1485,9 @@ class RPiConfigManager:
             return False, f"Wi-Fi connection '{ssid}' not found in saved connections."
 
         success, message = self.run_nmcli_command(['connection', 'delete', 'uuid', uuid_to_delete], 
-                                                 f"delete Wi-Fi connection '{ssid}'")
+                                                 f"delete Wi-Fi connection '{ssid}'", capture_stdout=False)
+        self._eth_name_cache.clear()
+        self._invalidate_wifi_status()
         if not success:
             return False, message
         
@@ -999,11 +1496,98 @@ class RPiConfigManager:
 
     def get_wifi_status(self):
         """Get comprehensive WiFi status including current connection and saved networks"""
+        # Status requests (often from several dashboards) and scans come close together,
+        # reuse a fresh result
+        cached_at, cached = self._wifi_status_cache
+        if cached is not None and time.monotonic() - cached_at < WIFI_STATUS_TTL:
+            return cached
+        
+        with self._wifi_status_lock:
+            # Someone else may have refreshed it while we waited for the lock
+            cached_at, cached = self._wifi_status_cache
+            if cached is not None and time.monotonic() - cached_at < WIFI_STATUS_TTL:
+                return cached
+            
+            wifi_status = self._query_wifi_status()
+            if "error" not in wifi_status:
+                self._wifi_status_cache = (time.monotonic(), wifi_status)
+            return wifi_status
+    
+    def _invalidate_wifi_status(self):
+        """Drop the cached WiFi status after the connection state was changed"""
+        self._wifi_status_cache = (0.0, None)
+        self._saved_wifi_cache = (0.0, None)
+    
+    def _cached_saved_wifi_connections(self):
+        """Saved WiFi connection names if queried less than 5 s ago, else None"""
+        cached_at, saved = self._saved_wifi_cache
+        if saved is not None and time.monotonic() - cached_at < 5.0:
+            return saved
+        return None
+    
+    def _store_saved_wifi_connections(self, output):
+        """Parse "nmcli -t -f NAME,TYPE connection show" output and cache the WiFi names"""
+        saved = []
+        for parts in _nmcli_rows(output):
+            if len(parts) >= 2 and parts[1] == '802-11-wireless':
+                saved.append(parts[0])
+        self._saved_wifi_cache = (time.monotonic(), saved)
+        return saved
+    
+    def _saved_wifi_connections_libnm(self):
+        """Saved WiFi connection names from the shared libnm client (cached), None if unavailable"""
+        if self._nm is None:
+            return None
         try:
-            # Get current connection status
-            success, output = self.run_nmcli_command(['-t', '-f', 'DEVICE,TYPE,STATE,CONNECTION', 'device', 'status'], 
-                                                    "get device status")
-            if not success:
+            self._refresh_nm_client()
+            saved = [connection.get_id() for connection in self._nm.get_connections()
+                     if connection.get_connection_type() == '802-11-wireless']
+        except Exception as e:
+            self.logger.warning(f"libnm connection list failed, using nmcli: {e}")
+            return None
+        self._saved_wifi_cache = (time.monotonic(), saved)
+        return saved
+    
+    def _fetch_saved_wifi_connections(self):
+        """Names of saved WiFi connections, cached for 5 s"""
+        saved = self._cached_saved_wifi_connections()
+        if saved is None:
+            saved = self._saved_wifi_connections_libnm()
+        if saved is not None:
+            return saved
+        
+        success, output = self.run_nmcli_command(['-t', '-f', 'NAME,TYPE', 'connection', 'show'],
+                                                 "get saved connections")
+        if not success:
+            return []
+        return self._store_saved_wifi_connections(output)
+    
+    def _query_wifi_status(self):
+        """Query WiFi status from NetworkManager (concurrent nmcli calls)"""
+        try:
+            commands = [
+                # State, connection and IP of wlan0
+                (['-t', '-f', 'GENERAL.STATE,GENERAL.CONNECTION,IP4.ADDRESS', 'device', 'show', 'wlan0'],
+                 "get wlan0 details"),
+                # SSID asli + signal strength of the access point in use
+                (['-t', '-f', 'IN-USE,SSID,SIGNAL', 'dev', 'wifi', 'list', 'ifname', 'wlan0', '--rescan', 'no'],
+                 "get current signal strength"),
+            ]
+            saved_names = self._cached_saved_wifi_connections()
+            if saved_names is None:
+                saved_names = self._saved_wifi_connections_libnm()
+            if saved_names is None:
+                commands.append((['-t', '-f', 'NAME,TYPE', 'connection', 'show'], "get saved connections"))
+            
+            results = self.run_nmcli_commands(commands)
+            success, output = results[0]
+            active_result = results[1]
+            if saved_names is None:
+                saved_success, saved_output = results[2]
+                saved_names = self._store_saved_wifi_connections(saved_output) if saved_success else []
+            else:
+                saved_success = True
+            if not success and not saved_success:
                 return {"connected": False, "current_network": None, "saved_networks": [], "error": output}
 
             wifi_status = {
@@ -1014,66 +1598,46 @@ class RPiConfigManager:
             }
             
             # Check WiFi device status
-            for line in output.splitlines():
-                parts = line.split(':')
-                if len(parts) >= 4 and parts[0] == 'wlan0':
-                    wifi_status["device_state"] = parts[2]
-                    
-                    if parts[2] == 'connected' and parts[3]:
-                        wifi_status["connected"] = True
-                        connection_name = parts[3]  # Simpan connection name
-                        
-                        # Get SSID asli dari connection profile
-                        ssid_success, ssid_output = self.run_nmcli_command(['-t', '-f', '802-11-wireless.ssid', 'connection', 'show', connection_name], 
-                                                                        "get real SSID")
-                        current_ssid = connection_name  # fallback
-                        if ssid_success and ssid_output.strip():
-                            for line in ssid_output.splitlines():
-                                if line.startswith('802-11-wireless.ssid:'):
-                                    current_ssid = line.split(':', 1)[1].strip()
-                                    break
-                        
-                        # Get detailed info for current connection
-                        ip_success, ip_output = self.run_nmcli_command(['device', 'show', 'wlan0'], "get wlan0 details")
-                        current_ip = None
-                        signal_strength = None
-                        
-                        if ip_success:
-                            import re
-                            # Extract IP address
-                            ip_match = re.search(r"IP4\.ADDRESS\[1\]:\s*(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})/\d+", ip_output)
-                            if ip_match:
-                                current_ip = ip_match.group(1)
-                        
-                        # Get signal strength for current connection
-                        signal_success, signal_output = self.run_nmcli_command(['-t', '-f', 'SSID,SIGNAL', 'dev', 'wifi'], 
-                                                                            "get current signal strength")
-                        if signal_success:
-                            for signal_line in signal_output.splitlines():
-                                signal_parts = signal_line.split(':')
-                                if len(signal_parts) >= 2 and signal_parts[0] == current_ssid:
-                                    signal_strength = signal_parts[1]
-                                    break
-                        
-                        wifi_status["current_network"] = {
-                            "ssid": current_ssid,
-                            "ip_address": current_ip,
-                            "signal_strength": signal_strength
-                        }
-                    break
+            fields = {}
+            if success:
+                for row in _nmcli_rows(output):
+                    if len(row) >= 2:
+                        fields.setdefault(row[0], row[1])
+            
+            # GENERAL.STATE looks like "100 (connected)"
+            state = fields.get('GENERAL.STATE', '')
+            if '(' in state:
+                wifi_status["device_state"] = state[state.find('(') + 1:state.rfind(')')]
+            connection_name = fields.get('GENERAL.CONNECTION', '')
+            
+            if wifi_status["device_state"] == 'connected' and connection_name:
+                wifi_status["connected"] = True
+                current_ssid = connection_name  # fallback
+                signal_strength = None
+                
+                active_success, active_output = active_result
+                if active_success:
+                    for row in _nmcli_rows(active_output):
+                        if len(row) == 3 and row[0] == '*':
+                            current_ssid = row[1] or connection_name
+                            signal_strength = row[2]
+                            break
+                
+                current_ip = fields.get('IP4.ADDRESS[1]', '').split('/')[0] or None
+                
+                wifi_status["current_network"] = {
+                    "ssid": current_ssid,
+                    "ip_address": current_ip,
+                    "signal_strength": signal_strength
+                }
             
             # Get all saved WiFi connections
-            saved_success, saved_output = self.run_nmcli_command(['-t', '-f', 'NAME,TYPE', 'connection', 'show'], 
-                                                                "get saved connections")
-            if saved_success:
-                for line in saved_output.splitlines():
-                    parts = line.split(':')
-                    if len(parts) >= 2 and parts[1] == '802-11-wireless':
-                        wifi_status["saved_networks"].append({
-                            "ssid": parts[0],
-                            "is_current": wifi_status["connected"] and wifi_status["current_network"] and 
-                                        wifi_status["current_network"]["ssid"] == parts[0]
-                        })
+            for name in saved_names:
+                wifi_status["saved_networks"].append({
+                    "ssid": name,
+                    "is_current": wifi_status["connected"] and wifi_status["current_network"] and 
+                                wifi_status["current_network"]["ssid"] == name
+                })
             
             return wifi_status
             
@@ -1086,14 +1650,14 @@ class RPiConfigManager:
     def reboot_system(self):
         """Memulai proses reboot sistem."""
         self.logger.warning("Memulai reboot sistem...")
-        self._publish_response("success", {"message": "Rebooting system..."})
+        self._publish("response", {"message": "Rebooting system..."}, status="success")
         time.sleep(2)
         os.system("sudo reboot")
 
     def factory_reset(self):
         """Memulai proses factory reset dengan konfigurasi default."""
         self.logger.critical("Memulai factory reset...")
-        self._publish_response("warning", {"message": "Initiating factory reset..."})
+        self._publish("response", {"message": "Initiating factory reset..."}, status="warning")
         
         try:
             # 1. Reset IP static eth0 ke 192.168.0.92
@@ -1149,7 +1713,8 @@ class RPiConfigManager:
             
             # Tulis konfigurasi default
             self.config = default_config
-            config_success = self.save_config()
+            self.save_config()
+            config_success = self.flush_config()  # must be on disk before the reboot
             
             if config_success:
                 self.logger.info("MQTT configuration reset to default successfully")
@@ -1157,13 +1722,13 @@ class RPiConfigManager:
                 self.logger.error("Failed to reset MQTT configuration")
 
             # 3. Publish status update
-            self._publish_response("success", {
+            self._publish("response", {
                 "message": "Factory reset completed. System will reboot...",
                 "ethernet_reset": success,
                 "config_reset": config_success,
                 "new_ip": "192.168.0.92",
                 "backup_created": os.path.exists(backup_path) if 'backup_path' in locals() else False
-            })
+            }, status="success")
 
             # 4. Restart thermal service untuk apply config baru
             self.logger.info("Restarting thermal service...")
@@ -1176,10 +1741,10 @@ class RPiConfigManager:
 
         except Exception as e:
             self.logger.error(f"Error during factory reset: {e}")
-            self._publish_response("error", {
+            self._publish("response", {
                 "message": "Factory reset failed",
                 "error": str(e)
-            })
+            }, status="error")
 
     def _create_default_config(self):
         """Helper function untuk membuat default config (optional)"""
@@ -1214,36 +1779,53 @@ class RPiConfigManager:
     
     def setup_mqtt(self):
         """Setup MQTT client"""
+        if self.mqtt_client is not None:
+            # One long-lived client per process, paho reconnects it by itself
+            return True
+        
         try:
-            self.mqtt_client = mqtt.Client(client_id=self.device_id)
+            import paho.mqtt.client as mqtt
+            
+            # Stable client id + persistent session, so a reconnect resumes
+            # the broker-side session instead of starting from scratch
+            self.mqtt_client = mqtt.Client(client_id=self.device_id, clean_session=False)
             self.mqtt_client.on_connect = self._on_connect
             self.mqtt_client.on_message = self._on_message
+            self.mqtt_client.on_socket_open = self._on_socket_open
+            self.mqtt_client.reconnect_delay_set(min_delay=1, max_delay=8)
+            # Broker marks us offline if the connection drops without a clean stop()
+            self.mqtt_client.will_set(self.topics["status"], payload=b"offline", qos=1, retain=True)
             
-            self.mqtt_client.connect(self.broker_host, self.broker_port, 60)
+            # Connect from the network thread, also retries if the broker isn't up yet
+            self.mqtt_client.connect_async(self.broker_host, self.broker_port, 30)
             self.mqtt_client.loop_start()
             
-            self.logger.info("MQTT connected to localhost")
+            self._publisher_thread = threading.Thread(target=self._publisher_loop, name="mqtt-publisher",
+                                                      daemon=True)
+            self._publisher_thread.start()
+            
+            self.logger.info("MQTT connecting to localhost")
             return True
             
         except Exception as e:
             self.logger.error(f"MQTT setup failed: {e}")
             return False
     
+    def _on_socket_open(self, client, userdata, sock):
+        """Disable Nagle so the small JSON responses are sent without delay"""
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except (OSError, AttributeError) as e:
+            self.logger.debug(f"Could not set TCP_NODELAY: {e}")
+    
     def _on_connect(self, client, userdata, flags, rc):
         """MQTT connected"""
         if rc == 0:
             self.logger.info("MQTT connected successfully")
             
-            topics_to_subscribe = [
-                "get", "set", "network_get", "network_set", 
-                "wifi_scan", "wifi_connect", "wifi_disconnect", "wifi_delete",
-                "wifi_status_get",
-                "reboot_request",   # Topik baru
-                "factory_reset_request"  # Topik baru
-            ]
-
-            for topic_key in topics_to_subscribe:
-                client.subscribe(self.topics[topic_key])
+            # One SUBSCRIBE packet for every request topic
+            client.subscribe([(self.topics[topic_key], 0) for topic_key in REQUEST_TOPIC_KEYS])
+            client.publish(self.topics["status"], b"online", qos=1, retain=True)
             
             self.logger.info("Subscribed to all configuration topics")
             
@@ -1254,60 +1836,68 @@ class RPiConfigManager:
         """Handle MQTT messages"""
         try:
             topic = msg.topic
-            payload_str = msg.payload.decode('utf-8')
-            
-            self.logger.info(f"Received: {topic} -> {payload_str}")
-            
-            if topic == self.topics["get"]:
-                self._handle_get_config()
-            elif topic == self.topics["set"]:
-                self._handle_set_config(payload_str)
-            elif topic == self.topics["network_get"]:
-                self._handle_get_network_config()
-            elif topic == self.topics["network_set"]:
-                self._handle_set_network_config(payload_str)
-            elif topic == self.topics["wifi_scan"]:
-                self._handle_wifi_scan()
-            elif topic == self.topics["wifi_connect"]:
-                self._handle_wifi_connect(payload_str)
-            elif topic == self.topics["wifi_disconnect"]:
-                self._handle_wifi_disconnect()
-            elif topic == self.topics["wifi_delete"]:
-                self._handle_wifi_delete(payload_str)
-            elif topic == self.topics["wifi_status_get"]:
-                self._handle_wifi_status_get()
-            elif topic == self.topics["reboot_request"]:
-                self.reboot_system()
-            elif topic == self.topics["factory_reset_request"]:
-                self.factory_reset()
+            handler = self._message_handlers.get(topic)
+            if handler is None:
+                return
+            # Handlers parse the bytes directly, decoding is only needed for the log
+            logger = self.logger
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("Received: %s -> %s", topic, msg.payload.decode('utf-8', 'replace'))
+            
+            if not self._pending_requests.acquire(blocking=False):
+                logger.warning("Dropping request on %s: %s requests pending", topic, MAX_PENDING_REQUESTS)
+                self._publish("response", {"error": "Too many pending requests, try again later"}, status="error")
+                return
+            try:
+                future = self._handler_pool.submit(self._run_handler, handler, msg.payload)
+                future.add_done_callback(self._release_cancelled_request)
+            except Exception:
+                self._pending_requests.release()
+                raise
                 
         except Exception as e:
-            self.logger.error(f"Error handling message: {e}")
-            self._publish_response("error", {"error": str(e)})
+            self.logger.error("Error handling message: %s", e)
+            self._publish("response", {"error": str(e)}, status="error")
+    
+    def _release_cancelled_request(self, future):
+        """Free the backlog slot of a request cancelled by stop(), it never reached _run_handler"""
+        if future.cancelled():
+            self._pending_requests.release()
     
-    def _handle_get_config(self):
+    def _run_handler(self, handler, raw_payload):
+        """Run one request handler on the worker thread"""
+        try:
+            handler(raw_payload)
+        except Exception as e:
+            self.logger.error("Error handling message: %s", e)
+            self._publish("response", {"error": str(e)}, status="error")
+        finally:
+            self._pending_requests.release()
+    
+    def _handle_get_config(self, raw_payload=None):
         """Handle get config request"""
         try:
-            self.load_config()
+            # While a save is pending the file on disk is older than self.config
+            if not self._config_dirty:
+                self.load_config()
             
             response_data = {
                 "action": "get_config",
                 "status": "success",
-                "timestamp": datetime.now().isoformat(),
                 "config": self.config
             }
             
-            self._publish_response("success", response_data)
+            self._publish("response", response_data, status="success")
             self.logger.info("Config sent successfully")
             
         except Exception as e:
-            self.logger.error(f"Error getting config: {e}")
-            self._publish_response("error", {"error": str(e)})
+            self.logger.error("Error getting config: %s", e)
+            self._publish("response", {"error": str(e)}, status="error")
     
-    def _handle_set_config(self, payload_str):
+    def _handle_set_config(self, raw_payload):
         """Handle set config request"""
         try:
-            payload = json.loads(payload_str)
+            payload = _loads(raw_payload)
             
             if "config" not in payload:
                 raise ValueError("Missing 'config' field")
@@ -1321,7 +1911,6 @@ class RPiConfigManager:
                 response_data = {
                     "action": "set_config",
                     "status": "success",
-                    "timestamp": datetime.now().isoformat(),
                     "message": "Config updated successfully"
                 }
                 
@@ -1333,19 +1922,21 @@ class RPiConfigManager:
                 if thermal_changed:
                     response_data["restart_required"] = True
                     response_data["message"] += " - Restarting thermal service..."
-                    self._restart_thermal_service()
+                    # Restarted by flush_config() once the new config is written
+                    with self._save_lock:
+                        self._restart_after_save = True
                 
-                self._publish_response("success", response_data)
+                self._publish("response", response_data, status="success")
                 self.logger.info("Config updated successfully")
                 
             else:
                 raise Exception("Failed to save config")
                 
         except Exception as e:
-            self.logger.error(f"Error setting config: {e}")
-            self._publish_response("error", {"error": str(e)})
+            self.logger.error("Error setting config: %s", e)
+            self._publish("response", {"error": str(e)}, status="error")
     
-    def _handle_get_network_config(self):
+    def _handle_get_network_config(self, raw_payload=None):
         """Handle get network config request"""
         try:
             success, config_data = self.read_current_ip_config()
@@ -1354,23 +1945,22 @@ class RPiConfigManager:
                 response_data = {
                     "action": "get_network_config",
                     "status": "success",
-                    "timestamp": datetime.now().isoformat(),
                     "network_method": self.network_method,
                     "network_config": config_data
                 }
-                self._publish_network_response("success", response_data)
+                self._publish("network_response", response_data, status="success")
                 self.logger.info("Network config sent successfully")
             else:
-                self._publish_network_response("error", {"error": config_data})
+                self._publish("network_response", {"error": config_data}, status="error")
                 
         except Exception as e:
-            self.logger.error(f"Error getting network config: {e}")
-            self._publish_network_response("error", {"error": str(e)})
+            self.logger.error("Error getting network config: %s", e)
+            self._publish("network_response", {"error": str(e)}, status="error")
     
-    def _handle_set_network_config(self, payload_str):
+    def _handle_set_network_config(self, raw_payload):
         """Handle set network config request"""
         try:
-            payload = json.loads(payload_str)
+            payload = _loads(raw_payload)
             
             interface = payload.get("interface", "eth0")
             method = payload.get("method")
@@ -1380,7 +1970,6 @@ class RPiConfigManager:
             
             response_data = {
                 "action": "set_network_config",
-                "timestamp": datetime.now().isoformat(),
                 "interface": interface,
                 "method": method,
                 "network_method": self.network_method
@@ -1401,7 +1990,7 @@ class RPiConfigManager:
                         gateway = f"{ip_parts[0]}.{ip_parts[1]}.{ip_parts[2]}.1"
                     else:
                         gateway = "192.168.0.1"
-                    self.logger.info(f"Using default gateway: {gateway}")
+                    self.logger.info("Using default gateway: %s", gateway)
                 
                 success, message = self.set_static_ip(interface, static_ip, netmask, gateway, dns)
                 response_data.update({
@@ -1420,10 +2009,10 @@ class RPiConfigManager:
             response_data["status"] = "success" if success else "error"
             response_data["message"] = message
             
-            self._publish_network_response("success" if success else "error", response_data)
+            self._publish("network_response", response_data, status="success" if success else "error")
             
             if success:
-                self.logger.info(f"Network config updated: {interface} -> {method}")
+                self.logger.info("Network config updated: %s -> %s", interface, method)
                 
                 if payload.get("reboot", False):
                     self.logger.info("Rebooting system after network configuration change...")
@@ -1431,10 +2020,10 @@ class RPiConfigManager:
                     os.system("sudo reboot")
             
         except Exception as e:
-            self.logger.error(f"Error setting network config: {e}")
-            self._publish_network_response("error", {"error": str(e)})
+            self.logger.error("Error setting network config: %s", e)
+            self._publish("network_response", {"error": str(e)}, status="error")
     
-    def _handle_wifi_scan(self):
+    def _handle_wifi_scan(self, raw_payload=None):
         """Handle WiFi scan request"""
         try:
             self.logger.info("Received WiFi scan request")
@@ -1443,39 +2032,37 @@ class RPiConfigManager:
             response_data = {
                 "action": "wifi_scan",
                 "status": "success",
-                "timestamp": datetime.now().isoformat(),
                 "networks": wifi_networks,
                 "count": len(wifi_networks)
             }
             
-            self._publish_wifi_response("wifi_scan_response", response_data)
-            self.logger.info(f"WiFi scan completed: {len(wifi_networks)} networks found")
+            self._publish("wifi_scan_response", response_data)
+            self.logger.info("WiFi scan completed: %s networks found", len(wifi_networks))
             
         except Exception as e:
-            self.logger.error(f"Error scanning WiFi: {e}")
-            self._publish_wifi_response("wifi_scan_response", {
+            self.logger.error("Error scanning WiFi: %s", e)
+            self._publish("wifi_scan_response", {
                 "action": "wifi_scan",
                 "status": "error", 
                 "error": str(e)
             })
     
-    def _handle_wifi_connect(self, payload_str):
+    def _handle_wifi_connect(self, raw_payload):
         """Handle WiFi connect request"""
         try:
-            payload = json.loads(payload_str)
+            payload = _loads(raw_payload)
             ssid = payload.get("ssid")
             password = payload.get("password")
             
             if not ssid:
                 raise ValueError("Missing 'ssid' field")
             
-            self.logger.info(f"Received WiFi connect request for: {ssid}")
+            self.logger.info("Received WiFi connect request for: %s", ssid)
             success, result = self.connect_wifi(ssid, password)
             
             response_data = {
                 "action": "wifi_connect",
                 "status": "success" if success else "error",
-                "timestamp": datetime.now().isoformat(),
                 "ssid": ssid,
                 "message": f"Connected to {ssid}" if success else result,
                 "ip_address": result if success else None
@@ -1484,17 +2071,17 @@ class RPiConfigManager:
             if not success:
                 response_data["error"] = result
             
-            self._publish_wifi_response("wifi_connect_response", response_data)
+            self._publish("wifi_connect_response", response_data)
             
         except Exception as e:
-            self.logger.error(f"Error connecting to WiFi: {e}")
-            self._publish_wifi_response("wifi_connect_response", {
+            self.logger.error("Error connecting to WiFi: %s", e)
+            self._publish("wifi_connect_response", {
                 "action": "wifi_connect",
                 "status": "error",
                 "error": str(e)
             })
     
-    def _handle_wifi_disconnect(self):
+    def _handle_wifi_disconnect(self, raw_payload=None):
         """Handle WiFi disconnect request"""
         try:
             self.logger.info("Received WiFi disconnect request")
@@ -1503,39 +2090,37 @@ class RPiConfigManager:
             response_data = {
                 "action": "wifi_disconnect",
                 "status": "success" if success else "error",
-                "timestamp": datetime.now().isoformat(),
                 "message": message
             }
             
             if not success:
                 response_data["error"] = message
             
-            self._publish_wifi_response("wifi_disconnect_response", response_data)
+            self._publish("wifi_disconnect_response", response_data)
             
         except Exception as e:
-            self.logger.error(f"Error disconnecting WiFi: {e}")
-            self._publish_wifi_response("wifi_disconnect_response", {
+            self.logger.error("Error disconnecting WiFi: %s", e)
+            self._publish("wifi_disconnect_response", {
                 "action": "wifi_disconnect", 
                 "status": "error",
                 "error": str(e)
             })
     
-    def _handle_wifi_delete(self, payload_str):
+    def _handle_wifi_delete(self, raw_payload):
         """Handle WiFi delete request"""
         try:
-            payload = json.loads(payload_str)
+            payload = _loads(raw_payload)
             ssid = payload.get("ssid")
             
             if not ssid:
                 raise ValueError("Missing 'ssid' field")
             
-            self.logger.info(f"Received WiFi delete request for: {ssid}")
+            self.logger.info("Received WiFi delete request for: %s", ssid)
             success, message = self.delete_wifi(ssid)
             
             response_data = {
                 "action": "wifi_delete",
                 "status": "success" if success else "error",
-                "timestamp": datetime.now().isoformat(),
                 "ssid": ssid,
                 "message": message
             }
@@ -1543,18 +2128,26 @@ class RPiConfigManager:
             if not success:
                 response_data["error"] = message
             
-            self._publish_wifi_response("wifi_delete_response", response_data)
+            self._publish("wifi_delete_response", response_data)
             
         except Exception as e:
-            self.logger.error(f"Error deleting WiFi: {e}")
-            self._publish_wifi_response("wifi_delete_response", {
+            self.logger.error("Error deleting WiFi: %s", e)
+            self._publish("wifi_delete_response", {
                 "action": "wifi_delete",
                 "status": "error", 
                 "error": str(e)
             })
     
 
-    def _handle_wifi_status_get(self):
+    def _handle_reboot_request(self, raw_payload=None):
+        """Handle reboot request"""
+        self.reboot_system()
+    
+    def _handle_factory_reset_request(self, raw_payload=None):
+        """Handle factory reset request"""
+        self.factory_reset()
+    
+    def _handle_wifi_status_get(self, raw_payload=None):
         """Handle WiFi status get request - NEW HANDLER"""
         try:
             self.logger.info("Received WiFi status get request")
@@ -1563,7 +2156,6 @@ class RPiConfigManager:
             response_data = {
                 "action": "wifi_status_get",
                 "status": "success",
-                "timestamp": datetime.now().isoformat(),
                 "wifi_status": wifi_status
             }
             
@@ -1572,116 +2164,122 @@ class RPiConfigManager:
                 response_data["status"] = "partial_error"
                 response_data["error_details"] = wifi_status["error"]
             
-            self._publish_wifi_status_response(response_data)
-            self.logger.info(f"WiFi status sent: Connected={wifi_status.get('connected', False)}")
+            self._publish("wifi_status_response", response_data)
+            self.logger.info("WiFi status sent: Connected=%s", wifi_status.get('connected', False))
             
         except Exception as e:
-            self.logger.error(f"Error handling WiFi status request: {e}")
-            self._publish_wifi_status_response({
+            self.logger.error("Error handling WiFi status request: %s", e)
+            self._publish("wifi_status_response", {
                 "action": "wifi_status_get",
                 "status": "error",
-                "timestamp": datetime.now().isoformat(),
                 "error": str(e)
             })
    
     def _restart_thermal_service(self):
-        """Restart thermal service"""
+        """Start a thermal service restart, the outcome is published on the response topic"""
         try:
             self.logger.info("Restarting thermal-mqtt service...")
-            result = os.system("sudo systemctl restart thermal-mqtt")
-            
-            if result == 0:
-                self.logger.info("Thermal service restarted successfully")
-                return True
-            else:
-                self.logger.error("Failed to restart thermal service")
-                return False
-                
+            proc = subprocess.Popen(["sudo", "systemctl", "restart", "thermal-mqtt"],
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
         except Exception as e:
-            self.logger.error(f"Error restarting thermal service: {e}")
+            self.logger.error("Error restarting thermal service: %s", e)
             return False
+        
+        # systemctl blocks until the service is back up, wait for it off the caller's thread
+        threading.Thread(target=self._wait_thermal_restart, args=(proc,), daemon=True).start()
+        return True
     
-    def _publish_response(self, status, data):
-        """Publish response"""
+    def _wait_thermal_restart(self, proc):
+        """Wait for a thermal service restart and publish its result"""
         try:
-            response = {
-                "status": status,
-                "timestamp": datetime.now().isoformat(),
-                "device_id": self.device_id,
-                **data
-            }
-            
-            self.mqtt_client.publish(
-                self.topics["response"],
-                json.dumps(response),
-                qos=1
-            )
-            
-        except Exception as e:
-            self.logger.error(f"Error publishing response: {e}")
+            _, stderr = proc.communicate(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.communicate()
+            stderr = "timed out"
+        
+        if proc.returncode == 0:
+            self.logger.info("Thermal service restarted successfully")
+            self._publish("response", {
+                "action": "restart_thermal_service",
+                "message": "Thermal service restarted"
+            }, status="success")
+        else:
+            error_msg = f"Failed to restart thermal service: {stderr.strip()}"
+            self.logger.error(error_msg)
+            self._publish("response", {"action": "restart_thermal_service", "error": error_msg}, status="error")
     
-    def _publish_network_response(self, status, data):
-        """Publish network response"""
-        try:
-            response = {
-                "status": status,
-                "timestamp": datetime.now().isoformat(),
-                "device_id": self.device_id,
-                **data
-            }
-            
-            self.mqtt_client.publish(
-                self.topics["network_response"],
-                json.dumps(response),
-                qos=1
-            )
-            
-        except Exception as e:
-            self.logger.error(f"Error publishing network response: {e}")
+    def _now_iso(self):
+        """Local time as an ISO timestamp with second resolution, formatted once per second"""
+        now = int(time.time())
+        second, iso = self._iso_cache
+        if now != second:
+            iso = datetime.fromtimestamp(now).isoformat()
+            self._iso_cache = (now, iso)
+        return iso
     
-    def _publish_wifi_response(self, topic_key, data):
-        """Publish WiFi response"""
-        try:
-            response = {
-                "timestamp": datetime.now().isoformat(),
-                "device_id": self.device_id,
-                **data
-            }
-            
-            self.mqtt_client.publish(
-                self.topics[topic_key],
-                json.dumps(response),
-                qos=1
-            )
+    def _publisher_loop(self):
+        """Publish queued responses, whatever queued up meanwhile goes out back to back"""
+        while True:
+            batch = [self._publish_queue.get()]
+            while len(batch) < 32:
+                try:
+                    batch.append(self._publish_queue.get_nowait())
+                except queue.Empty:
+                    break
             
-        except Exception as e:
-            self.logger.error(f"Error publishing WiFi response: {e}")
+            for item in batch:
+                if item is None:  # stop()
+                    return
+                topic, payload, qos = item
+                try:
+                    self.mqtt_client.publish(topic, payload, qos=qos)
+                except Exception as e:
+                    self.logger.error("Error publishing to %s: %s", topic, e)
     
-
-    def _publish_wifi_status_response(self, data):
-        """Publish WiFi status response - NEW FUNCTION"""
+    def _publish(self, topic_key, data, status=None):
+        """Publish a response on self.topics[topic_key], stamped with time and device id"""
         try:
-            response = {
-                "timestamp": datetime.now().isoformat(),
-                "device_id": self.device_id,
-                **data
-            }
-            
-            self.mqtt_client.publish(
-                self.topics["wifi_status_response"],
-                json.dumps(response),
-                qos=1
-            )
+            # Envelope fields in data win, like a dict update would do
+            status = data.get("status", status)
+            timestamp = data.get("timestamp") or self._now_iso()
+            body = {key: value for key, value in data.items() if key not in ENVELOPE_KEYS}
+            
+            # '{"status":..,"timestamp":..,"device_id":..' is serialized once per status and second
+            cached_timestamp, heads = self._envelope_cache
+            if cached_timestamp != timestamp:
+                heads = {}
+                self._envelope_cache = (timestamp, heads)
+            head = heads.get(status)
+            if head is None:
+                envelope = {"status": status} if status is not None else {}
+                envelope["timestamp"] = timestamp
+                envelope["device_id"] = self.device_id
+                head = heads[status] = _dumps(envelope)[:-1]
+            
+            payload = head + b',' + _dumps(body)[1:] if body else head + b'}'
+            topic = self.topics[topic_key]
+            if topic_key.startswith("wifi_"):
+                topic, payload = self._compress_wifi_payload(topic, payload)
+            self._publish_queue.put((topic, payload, RESPONSE_QOS))
             
         except Exception as e:
-            self.logger.error(f"Error publishing WiFi status response: {e}")
-
+            self.logger.error("Error publishing %s: %s", topic_key, e)
+    
+    def _compress_wifi_payload(self, topic, payload):
+        """Opt-in: move a large WiFi payload to <topic>/z as a zlib stream"""
+        if len(payload) <= WIFI_COMPRESS_THRESHOLD:
+            return topic, payload
+        if not self.config.get("config_manager", {}).get("compress_wifi", False):
+            return topic, payload
+        return topic + "/z", zlib.compress(payload, 3)
 
     def start(self):
         """Start config manager"""
         self.logger.info("Starting RPi Config Manager with Network Management...")
         
-        # Mulai pemantauan tombol
+        # Inisialisasi dan mulai pemantauan tombol
+        self.button_handler = ButtonHandler(self)
         self.button_handler.start()
         
         if not self.setup_mqtt():
@@ -1691,10 +2289,12 @@ class RPiConfigManager:
         self.running = True
         
         try:
-            while self.running:
-                time.sleep(1)
+            # Sleep until stop(), MQTT and the button run on their own threads
+            self._stop_event.wait()
         except KeyboardInterrupt:
             self.logger.info("Stopped by user")
+        finally:
+            self.flush_config()
         
         return True
     
@@ -1702,8 +2302,20 @@ class RPiConfigManager:
         """Stop config manager"""
         self.logger.info("Stopping RPi Config Manager...")
         self.running = False
+        self._stop_event.set()
+        self.flush_config()
+        
+        # Requests that are still queued are not started anymore
+        self._handler_pool.shutdown(wait=False, cancel_futures=True)
+        
+        # Let the writer publish what is still queued
+        if self._publisher_thread is not None:
+            self._publish_queue.put(None)
+            self._publisher_thread.join(timeout=2)
         
         if self.mqtt_client:
+            # A clean disconnect doesn't fire the will, so say goodbye ourselves
+            self.mqtt_client.publish(self.topics["status"], b"offline", qos=1, retain=True)
             time.sleep(1)
             self.mqtt_client.loop_stop()
             self.mqtt_client.disconnect()
@@ -1715,10 +2327,15 @@ def signal_handler(signum, frame):
     sys.exit(0)
 
 signal.signal(signal.SIGINT, signal_handler)
+signal.signal(signal.SIGTERM, signal_handler)  # systemd stop/restart/reboot
 
 def main():
     manager = RPiConfigManager()
-    manager.start()
+    try:
+        manager.start()
+    finally:
+        # Writes a debounced config change that is still pending
+        manager.stop()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file